@@ -66,10 +66,11 @@ class TrainingAdmin(admin.ModelAdmin):
                    'unenroll_deadline', 'gender')
     search_fields = ('gym__name', 'trainer__user__email')
     date_hierarchy = 'date'
+    readonly_fields = ('current_participants',)
 
     fieldsets = (
         (None, {'fields': ('gym', 'trainer', 'date', 'level', 'max_participants',
-         'current_participants', 'unenroll_deadline', 'gender')}),
+         'current_participants', 'unenroll_deadline', 'gender', 'queued_enrollment')}),
 
     )
 
@@ -0,0 +1,178 @@
+import logging
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .models import CrmContact
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты запросов: не больше rate запросов в секунду
+    с допустимым всплеском capacity. Общий для всех потоков процесса.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        # Токен уже занят, ждём его появления вне блокировки
+        if wait:
+            time.sleep(wait)
+
+
+def make_session(pool_size):
+    """
+    Session с пулом keep-alive соединений. Повторяются только ошибки
+    соединения и ответы 429/503, после которых запрос точно не выполнен,
+    поэтому повтор POST не создаст контакт дважды.
+    """
+    retry = Retry(
+        total=3, connect=3, read=0, backoff_factor=0.5,
+        status_forcelist=(429, 503), allowed_methods=None,
+        respect_retry_after_header=True, raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class AmoCRMClient:
+    """
+    Клиент API AmoCRM v4: одна Session на процесс, таймауты на каждый
+    запрос, ограничение частоты и разбиение списков сущностей на пачки
+    по batch_size.
+    """
+
+    def __init__(self, base_url, access_token, rate_limit, batch_size, timeout, pool_size=10, session=None):
+        self.base_url = base_url.rstrip('/')
+        self.access_token = access_token
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate_limit)
+        self.session = session or make_session(pool_size)
+
+    def request(self, method, path, auth=True, **kwargs):
+        headers = kwargs.pop('headers', {})
+        if auth:
+            headers['Authorization'] = f'Bearer {self.access_token}'
+        self.bucket.acquire()
+        response = self.session.request(
+            method, f'{self.base_url}{path}', headers=headers, timeout=self.timeout, **kwargs)
+        response.raise_for_status()
+        return response.json() if response.content else {}
+
+    def batches(self, items):
+        for start in range(0, len(items), self.batch_size):
+            yield items[start:start + self.batch_size]
+
+    def create_contacts(self, contacts):
+        """
+        Создаёт контакты пачками. Возвращает {request_id: id контакта};
+        request_id каждого контакта задаёт вызывающий код.
+        """
+        created = {}
+        for batch in self.batches(contacts):
+            data = self.request('POST', '/api/v4/contacts', json=batch)
+            for contact in data.get('_embedded', {}).get('contacts', []):
+                created[contact['request_id']] = contact['id']
+        return created
+
+    def update_contacts(self, contacts):
+        for batch in self.batches(contacts):
+            self.request('PATCH', '/api/v4/contacts', json=batch)
+
+    def exchange_code(self, code):
+        # Обмен кода авторизации на токены (OAuth 2.0)
+        return self.request('POST', '/oauth2/access_token', auth=False, json={
+            'client_id': settings.AMOCRM_CLIENT_ID,
+            'client_secret': settings.AMOCRM_CLIENT_SECRET,
+            'grant_type': 'authorization_code',
+            'code': code,
+            'redirect_uri': settings.AMOCRM_REDIRECT_URI,
+        })
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Общий для процесса клиент: пул соединений и лимит частоты делятся
+    между всеми потоками, например воркерами run_jobs.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = AmoCRMClient(
+                settings.AMOCRM_BASE_URL,
+                settings.AMOCRM_ACCESS_TOKEN,
+                rate_limit=settings.AMOCRM_RATE_LIMIT,
+                batch_size=settings.AMOCRM_BATCH_SIZE,
+                timeout=settings.AMOCRM_TIMEOUT,
+                pool_size=settings.AMOCRM_POOL_SIZE,
+            )
+        return _client
+
+
+def notification_fields(message):
+    return [{
+        'field_id': settings.AMOCRM_NOTIFICATION_FIELD_ID,
+        'values': [{'value': message}],
+    }]
+
+
+def push_notifications(pairs, client=None):
+    """
+    Записывает уведомления (пользователь, текст) в контакты AmoCRM.
+    Контакты из CrmContact обновляются пачками PATCH, для остальных
+    пользователей контакты создаются пачками POST и запоминаются после
+    каждой пачки: если следующая пачка упадёт, повтор не создаст уже
+    созданные контакты заново. Если у пользователя несколько уведомлений,
+    в контакт попадает последнее.
+    """
+    client = client or get_client()
+    latest = {user.pk: (user, message) for user, message in pairs}
+    if not latest:
+        return
+    known = dict(CrmContact.objects.filter(
+        user_id__in=latest).values_list('user_id', 'contact_id'))
+
+    client.update_contacts([
+        {'id': known[user_id], 'custom_fields_values': notification_fields(message)}
+        for user_id, (user, message) in latest.items() if user_id in known
+    ])
+    created = 0
+    for batch in client.batches([
+        {'name': user.first_name, 'request_id': str(user_id),
+         'custom_fields_values': notification_fields(message)}
+        for user_id, (user, message) in latest.items() if user_id not in known
+    ]):
+        contacts = client.create_contacts(batch)
+        # Параллельный запуск мог уже сохранить контакт — оставляем первый
+        CrmContact.objects.bulk_create([
+            CrmContact(user_id=int(request_id), contact_id=contact_id)
+            for request_id, contact_id in contacts.items()
+        ], ignore_conflicts=True)
+        created += len(contacts)
+    logger.info(
+        f"AmoCRM: updated {len(known)} contacts, created {created}")
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class BackendConfig(AppConfig):
+    name = 'backend'
+
+    def ready(self):
+        # Подключение обработчиков сигналов
+        from . import signals  # noqa: F401
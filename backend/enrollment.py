@@ -0,0 +1,608 @@
+import datetime
+import logging
+import traceback
+from collections import Counter, defaultdict, namedtuple
+from dataclasses import dataclass, field
+
+from django.db import transaction
+from django.db.models import DateTimeField, Exists, ExpressionWrapper, F, Max, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .inbox import create_notifications
+from .models import CONFIRMATION_REMIND_BEFORE, CONFIRMATION_WINDOW, EnrollmentTicket, Notification, Reservation, Subscription, Training, WaitlistEntry
+from .outbox import publish_many
+from .utils import start_of_day
+
+logger = logging.getLogger(__name__)
+
+def is_enrolled(training_id, user_id):
+    return Reservation.objects.filter(training_id=training_id, user_id=user_id).exists()
+
+
+def take_seat(training_id):
+    """
+    Занимает место на тренировке одним условным UPDATE.
+    Возвращает False, если свободных мест нет.
+    """
+    updated = Training.objects.filter(
+        pk=training_id,
+        current_participants__lt=F('max_participants'),
+    ).update(current_participants=F('current_participants') + 1)
+    return updated == 1
+
+
+@dataclass
+class EnrollmentResult:
+    """
+    Итог записи по абонементу: записанные тренировки и пропущенные
+    в виде пар (тренировка, причина).
+    """
+    enrolled: list = field(default_factory=list)
+    skipped: list = field(default_factory=list)
+
+
+def enroll_subscription(subscription):
+    """
+    Записывает владельца абонемента на все подходящие тренировки набором
+    запросов фиксированного размера: выборка с блокировкой строк тренировок,
+    bulk-вставка участников, одно обновление счётчиков и одно списание
+    trainings_left.
+    """
+    result = EnrollmentResult()
+    if not subscription.is_paid:
+        logger.info(
+            f"Subscription {subscription.id} is not paid, skipping enrollment")
+        return result
+
+    user = subscription.user
+    with transaction.atomic():
+        # Остаток читаем из заблокированной строки: параллельная запись по
+        # тому же абонементу ждёт здесь и видит уже списанные тренировки
+        seats_left = Subscription.objects.select_for_update().values_list(
+            'trainings_left', flat=True).get(pk=subscription.pk)
+        # Строки блокируются в порядке pk, чтобы параллельные записи
+        # на пересекающиеся тренировки не взаимоблокировались
+        candidates = list(
+            Training.objects.select_for_update()
+            .filter(
+                gym_id=subscription.gym_id,
+                date__gte=start_of_day(subscription.start_date),
+                date__lt=start_of_day(
+                    subscription.end_date + datetime.timedelta(days=1)),
+                level=user.level,
+            )
+            .filter(Q(gender=user.gender) | Q(gender='any'))
+            .filter(subscription.training_filter())
+            .exclude(Exists(Reservation.objects.filter(
+                training_id=OuterRef('pk'), user_id=user.pk)))
+            .order_by('pk')
+        )
+        candidates.sort(key=lambda training: (training.date, training.pk))
+
+        for training in candidates:
+            if training.current_participants >= training.max_participants:
+                result.skipped.append((training, 'full'))
+            elif len(result.enrolled) >= seats_left:
+                result.skipped.append((training, 'no_trainings_left'))
+            else:
+                result.enrolled.append(training)
+
+        apply_allocations([
+            (training.pk, subscription.pk, user.pk) for training in result.enrolled
+        ])
+        subscription.trainings_left = seats_left - len(result.enrolled)
+        for training in result.enrolled:
+            training.current_participants += 1
+
+    logger.info(
+        f"Subscription {subscription.id}: enrolled to {len(result.enrolled)} trainings, "
+        f"skipped {len(result.skipped)} of {len(candidates)} candidates")
+    return result
+
+
+def enroll_paid_subscriptions(payloads):
+    """
+    Обработчик события outbox subscription.paid: записывает владельцев
+    оплаченных абонементов на тренировки. Повторная доставка безопасна —
+    тренировки, на которые пользователь уже записан, пропускаются.
+    Возвращает {индекс payload: ошибка} для абонементов, запись по которым
+    не удалась: остальные события пачки считаются обработанными.
+    """
+    subscriptions = Subscription.objects.select_related('user').in_bulk(
+        {payload['subscription_id'] for payload in payloads})
+    failures = {}
+    # Абонементы обрабатываются в порядке pk, как и прежде
+    for index, payload in sorted(enumerate(payloads), key=lambda item: item[1]['subscription_id']):
+        subscription = subscriptions.get(payload['subscription_id'])
+        if subscription is None:
+            continue
+        try:
+            enroll_subscription(subscription)
+        except Exception:
+            failures[index] = traceback.format_exc()
+    return failures
+
+
+# Облегчённые записи для распределения мест без обращения к ORM
+TrainingSlot = namedtuple(
+    'TrainingSlot', 'id gym_id level gender day weekday month_key free')
+SubscriptionSlot = namedtuple(
+    'SubscriptionSlot', 'id user_id gym_id level gender weekday_mask months start_date end_date priority')
+
+
+def training_slot(values):
+    """
+    TrainingSlot из словаря values() тренировки.
+    """
+    local_date = timezone.localtime(values['date'])
+    return TrainingSlot(
+        id=values['id'],
+        gym_id=values['gym_id'],
+        level=values['level'],
+        gender=values['gender'],
+        day=local_date.date(),
+        weekday=local_date.weekday(),
+        month_key=local_date.year * 100 + local_date.month,
+        free=values['max_participants'] - values['current_participants'],
+    )
+
+
+def subscription_slot(values):
+    """
+    SubscriptionSlot из словаря values() абонемента (с user__level и user__gender).
+    """
+    return SubscriptionSlot(
+        id=values['id'],
+        user_id=values['user_id'],
+        gym_id=values['gym_id'],
+        level=values['user__level'],
+        gender=values['user__gender'],
+        weekday_mask=values['weekday_mask'],
+        months=frozenset(values['months']),
+        start_date=values['start_date'],
+        end_date=values['end_date'],
+        priority=values['reserve_priority'],
+    )
+
+
+SUBSCRIPTION_SLOT_FIELDS = ('id', 'user_id', 'gym_id', 'user__level', 'user__gender', 'weekday_mask', 'months',
+                            'start_date', 'end_date', 'reserve_priority', 'trainings_left')
+TRAINING_SLOT_FIELDS = ('id', 'gym_id', 'level', 'gender',
+                        'date', 'max_participants', 'current_participants')
+
+
+def covers(subscription, training):
+    """
+    Покрывает ли SubscriptionSlot день TrainingSlot: срок, дни недели, месяцы.
+    """
+    return (
+        subscription.start_date <= training.day <= subscription.end_date
+        and (not subscription.weekday_mask or subscription.weekday_mask & (1 << training.weekday))
+        and (not subscription.months or training.month_key in subscription.months)
+    )
+
+
+def allocate_seats(trainings, subscriptions, seats_left, enrolled=()):
+    """
+    Распределяет свободные места тренировок между абонементами.
+
+    trainings — TrainingSlot в порядке (дата, id); subscriptions — SubscriptionSlot;
+    seats_left — {subscription_id: trainings_left}, уменьшается по ходу распределения;
+    enrolled — пары (training_id, user_id), уже записанные на тренировку.
+
+    На каждую тренировку кандидаты идут по убыванию reserve_priority, затем по
+    числу мест, уже выданных абонементу в этом проходе, затем по id, поэтому
+    результат детерминирован и места делятся равномерно.
+    Возвращает список (training_id, subscription_id, user_id).
+    """
+    buckets = defaultdict(list)
+    for subscription in subscriptions:
+        buckets[(subscription.gym_id, subscription.level)].append(subscription)
+
+    taken = set(enrolled)
+    granted = Counter()
+    allocations = []
+    for training in trainings:
+        if training.free <= 0:
+            continue
+        candidates = [
+            subscription for subscription in buckets.get((training.gym_id, training.level), ())
+            if seats_left.get(subscription.id, 0) > 0
+            and training.gender in ('any', subscription.gender)
+            and covers(subscription, training)
+        ]
+        candidates.sort(key=lambda subscription: (
+            -subscription.priority, granted[subscription.id], subscription.id))
+
+        free = training.free
+        for subscription in candidates:
+            if not free:
+                break
+            # У пользователя может быть несколько абонементов — место одно
+            if (training.id, subscription.user_id) in taken:
+                continue
+            taken.add((training.id, subscription.user_id))
+            allocations.append(
+                (training.id, subscription.id, subscription.user_id))
+            seats_left[subscription.id] -= 1
+            granted[subscription.id] += 1
+            free -= 1
+    return allocations
+
+
+def apply_allocations(allocations, batch_size=1000):
+    """
+    Записывает результат allocate_seats: bulk-вставка участников и по одному
+    UPDATE счётчиков тренировок и остатков абонементов на каждое значение шага.
+    """
+    if not allocations:
+        return
+    Reservation.objects.bulk_create([
+        Reservation(training_id=training_id, user_id=user_id, subscription_id=subscription_id)
+        for training_id, subscription_id, user_id in allocations
+    ], batch_size=batch_size)
+    schedule_confirmations({training_id for training_id, _, _ in allocations})
+    _shift_counters(Training, 'current_participants', Counter(
+        training_id for training_id, _, _ in allocations))
+    _shift_counters(Subscription, 'trainings_left', Counter(
+        subscription_id for _, subscription_id, _ in allocations), sign=-1)
+
+
+def schedule_confirmations(training_ids, reset=False):
+    """
+    Проставляет remind_at и expire_at записям на тренировки по их текущей
+    дате одним UPDATE. По умолчанию только записям без сроков (после
+    bulk-вставки); reset=True пересчитывает все и снова ставит их в очередь
+    напоминаний — после переноса тренировки.
+    """
+    training_date = Subquery(Training.objects.filter(
+        pk=OuterRef('training_id')).values('date')[:1])
+    # Как в Reservation.deadlines: напоминание не раньше текущего момента
+    remind_at = Greatest(
+        ExpressionWrapper(training_date - CONFIRMATION_REMIND_BEFORE, output_field=DateTimeField()),
+        Value(timezone.now()),
+    )
+    rows = Reservation.objects.filter(training_id__in=training_ids)
+    updates = {
+        'remind_at': remind_at,
+        'expire_at': ExpressionWrapper(remind_at + CONFIRMATION_WINDOW, output_field=DateTimeField()),
+    }
+    if reset:
+        updates['reminded_at'] = None
+    else:
+        rows = rows.filter(remind_at__isnull=True)
+    return rows.update(**updates)
+
+
+def _shift_counters(model, field_name, deltas, sign=1):
+    # Строки с одинаковым приращением обновляются одним запросом
+    by_delta = defaultdict(list)
+    for pk, delta in deltas.items():
+        by_delta[delta].append(pk)
+    for delta, pks in by_delta.items():
+        model.objects.filter(pk__in=pks).update(
+            **{field_name: F(field_name) + sign * delta})
+
+
+def auto_enroll_trainings(trainings):
+    """
+    Заполняет только что созданные тренировки оплаченными абонементами, чьи
+    зал, уровень, пол, дни недели и месяцы подходят, в порядке reserve_priority.
+    Работает на всю пачку тренировок сразу. Возвращает список распределений.
+    """
+    training_ids = [training.pk for training in trainings if training.pk]
+    if not training_ids:
+        return []
+
+    with transaction.atomic():
+        rows = list(
+            Training.objects.select_for_update()
+            .filter(pk__in=training_ids)
+            .order_by('pk')
+            .values(*TRAINING_SLOT_FIELDS)
+        )
+        slots = sorted((training_slot(row) for row in rows),
+                       key=lambda slot: (slot.day, slot.id))
+        if not slots:
+            return []
+
+        subscription_rows = list(
+            Subscription.objects.filter(
+                is_paid=True,
+                trainings_left__gt=0,
+                gym_id__in={slot.gym_id for slot in slots},
+                user__level__in={slot.level for slot in slots},
+                start_date__lte=max(slot.day for slot in slots),
+                end_date__gte=min(slot.day for slot in slots),
+            ).values(*SUBSCRIPTION_SLOT_FIELDS)
+        )
+        if not subscription_rows:
+            return []
+
+        enrolled = set(Reservation.objects.filter(
+            training_id__in=training_ids).values_list('training_id', 'user_id'))
+        allocations = allocate_seats(
+            slots,
+            [subscription_slot(row) for row in subscription_rows],
+            {row['id']: row['trainings_left'] for row in subscription_rows},
+            enrolled,
+        )
+        apply_allocations(allocations)
+
+    logger.info(
+        f"Auto-enrolled {len(allocations)} seats into {len(slots)} new trainings")
+    return allocations
+
+
+def promote_waitlist(training_ids, exclude_user_ids=()):
+    """
+    Переводит людей из резерва на свободные места указанных тренировок.
+    Вызывается в той же транзакции, что освобождает места; число запросов не
+    зависит от количества тренировок. Переводятся только те, у кого есть
+    оплаченный абонемент с остатком, покрывающий день тренировки — с него
+    и списывается занятие. Возвращает список распределений.
+    """
+    training_ids = list(training_ids)
+    if not training_ids:
+        return []
+
+    with transaction.atomic():
+        rows = list(
+            Training.objects.select_for_update()
+            .filter(pk__in=training_ids, current_participants__lt=F('max_participants'))
+            .order_by('pk')
+            .values(*TRAINING_SLOT_FIELDS)
+        )
+        if not rows:
+            return []
+        slots = {row['id']: training_slot(row) for row in rows}
+
+        entries = list(
+            WaitlistEntry.objects.filter(training_id__in=slots)
+            .order_by('training_id', '-is_priority', '-priority', 'id')
+            .values_list('id', 'training_id', 'user_id')
+        )
+        if not entries:
+            return []
+
+        subscriptions = defaultdict(list)
+        seats_left = {}
+        for row in (Subscription.objects
+                    .filter(user_id__in={user_id for _, _, user_id in entries},
+                            is_paid=True, trainings_left__gt=0)
+                    .order_by('end_date', 'id')
+                    .values(*SUBSCRIPTION_SLOT_FIELDS)):
+            subscriptions[row['user_id']].append(subscription_slot(row))
+            seats_left[row['id']] = row['trainings_left']
+
+        enrolled = set(Reservation.objects.filter(
+            training_id__in=slots).values_list('training_id', 'user_id'))
+
+        allocations, done_entries = [], []
+        free = {training_id: slot.free for training_id, slot in slots.items()}
+        for entry_id, training_id, user_id in entries:
+            if (training_id, user_id) in enrolled:
+                # Пользователь уже записан — запись в резерве больше не нужна
+                done_entries.append(entry_id)
+                continue
+            if free[training_id] <= 0 or user_id in exclude_user_ids:
+                continue
+            subscription = next((
+                subscription for subscription in subscriptions[user_id]
+                if seats_left[subscription.id] > 0 and covers(subscription, slots[training_id])
+            ), None)
+            if subscription is None:
+                continue
+            allocations.append((training_id, subscription.id, user_id))
+            done_entries.append(entry_id)
+            seats_left[subscription.id] -= 1
+            free[training_id] -= 1
+
+        apply_allocations(allocations)
+        if done_entries:
+            WaitlistEntry.objects.filter(pk__in=done_entries).delete()
+
+    if allocations:
+        logger.info(
+            f"Promoted {len(allocations)} users from waitlists of {len(slots)} trainings")
+    return allocations
+
+
+def cancel_expired_reservations(now=None):
+    """
+    Снимает все неподтверждённые записи с истёкшим expire_at одним проходом:
+    выборка по индексу expire_at, одно удаление, сдвиг счётчиков по
+    тренировкам и перевод резерва на освободившиеся места. Снятые в этом
+    проходе пользователи из резерва не переводятся; уведомления о снятии
+    (письма через outbox и в почтовый ящик) создаются в той же транзакции.
+    Возвращает снятые записи.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        expired = list(
+            Reservation.objects.select_for_update(skip_locked=True, of=('self',))
+            .filter(status='pending', expire_at__lte=now, training__date__gt=now)
+            .select_related('user', 'training')
+            .order_by('pk')
+        )
+        if not expired:
+            return []
+
+        Reservation.objects.filter(
+            pk__in=[reservation.pk for reservation in expired]).delete()
+        removed = Counter(reservation.training_id for reservation in expired)
+        _shift_counters(Training, 'current_participants', removed, sign=-1)
+        promote_waitlist(
+            removed, exclude_user_ids={reservation.user_id for reservation in expired})
+        publish_many('reservation.cancelled', [
+            {'user_id': reservation.user_id, 'training_id': reservation.training_id}
+            for reservation in expired
+        ])
+        create_notifications([
+            Notification(user_id=reservation.user_id, type='reservation_cancelled',
+                         training_id=reservation.training_id)
+            for reservation in expired
+        ])
+
+    logger.info(
+        f"Cancelled {len(expired)} unconfirmed reservations in {len(removed)} trainings")
+    return expired
+
+
+def process_enrollment_tickets(training_id, batch_size=100):
+    """
+    Обрабатывает пачку ожидающих заявок одной тренировки теми же правилами,
+    что и TrainingEnrollView: уже записанным — отказ, при нехватке мест —
+    резерв, затем проверка абонемента (is_valid_for_training и остаток).
+    Строка тренировки блокируется с SKIP LOCKED, поэтому на тренировку
+    работает один обработчик. Возвращает число обработанных заявок или
+    None, если тренировку уже обрабатывает другой процесс.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        training = (Training.objects.select_for_update(skip_locked=True)
+                    .filter(pk=training_id).first())
+        if training is None:
+            return None
+
+        tickets = list(
+            EnrollmentTicket.objects.filter(training_id=training_id, status='pending')
+            .order_by('id')
+            .values_list('id', 'user_id')[:batch_size]
+        )
+        if not tickets:
+            return 0
+        user_ids = {user_id for _, user_id in tickets}
+
+        enrolled = set(Reservation.objects.filter(
+            training_id=training_id, user_id__in=user_ids).values_list('user_id', flat=True))
+        priority_users = set(training.priority_participants.filter(
+            pk__in=user_ids).values_list('pk', flat=True))
+        subscriptions = {}
+        for subscription in (Subscription.objects
+                             .filter(user_id__in=user_ids, is_paid=True)
+                             .order_by('user_id', 'id')):
+            subscriptions.setdefault(subscription.user_id, subscription)
+
+        free = training.max_participants - training.current_participants
+        outcomes = defaultdict(list)
+        allocations, waitlist = [], []
+        for ticket_id, user_id in tickets:
+            subscription = subscriptions.get(user_id)
+            if user_id in enrolled:
+                outcomes[('rejected', 'already_enrolled')].append(ticket_id)
+            elif free <= 0:
+                waitlist.append(WaitlistEntry(
+                    training_id=training_id,
+                    user_id=user_id,
+                    is_priority=user_id in priority_users,
+                    priority=subscription.reserve_priority if subscription else 0,
+                ))
+                outcomes[('reserved', '')].append(ticket_id)
+            elif subscription is None:
+                outcomes[('rejected', 'no_subscription')].append(ticket_id)
+            elif not subscription.is_valid_for_training(training):
+                outcomes[('rejected', 'subscription_not_valid')].append(ticket_id)
+            elif subscription.trainings_left <= 0:
+                outcomes[('rejected', 'no_trainings_left')].append(ticket_id)
+            else:
+                allocations.append((training_id, subscription.id, user_id))
+                outcomes[('enrolled', '')].append(ticket_id)
+                enrolled.add(user_id)
+                subscription.trainings_left -= 1
+                free -= 1
+
+        apply_allocations(allocations)
+        if allocations:
+            WaitlistEntry.objects.filter(
+                training_id=training_id,
+                user_id__in=[user_id for _, _, user_id in allocations],
+            ).delete()
+        WaitlistEntry.objects.bulk_create(waitlist, ignore_conflicts=True)
+        for (ticket_status, detail), ticket_ids in outcomes.items():
+            EnrollmentTicket.objects.filter(pk__in=ticket_ids).update(
+                status=ticket_status, detail=detail, processed_at=now)
+
+    logger.info(
+        f"Processed {len(tickets)} enrollment tickets for training {training_id}: "
+        f"{len(allocations)} enrolled, {len(waitlist)} reserved")
+    return len(tickets)
+
+
+def apply_roster_operations(training_id, operations):
+    """
+    Применяет к составу тренировки список операций (op, user_id) одной
+    транзакцией: add — записать, remove — убрать из состава и резерва,
+    reserve — перевести в резерв. Операции над одним пользователем
+    применяются по порядку, в базу пишется только итоговая разница:
+    bulk-вставка и удаление участников, одно обновление счётчика.
+    Абонементы не списываются — это ручное управление тренера.
+    Бросает ValueError, если итоговый состав превышает max_participants.
+    """
+    with transaction.atomic():
+        training = Training.objects.select_for_update().get(pk=training_id)
+        participants = set(Reservation.objects.filter(
+            training_id=training_id).values_list('user_id', flat=True))
+        reserve = set(WaitlistEntry.objects.filter(
+            training_id=training_id).values_list('user_id', flat=True))
+
+        final_participants, final_reserve = set(participants), set(reserve)
+        for op, user_id in operations:
+            if op == 'add':
+                final_participants.add(user_id)
+                final_reserve.discard(user_id)
+            elif op == 'remove':
+                final_participants.discard(user_id)
+                final_reserve.discard(user_id)
+            elif op == 'reserve':
+                final_participants.discard(user_id)
+                final_reserve.add(user_id)
+
+        if len(final_participants) > training.max_participants:
+            raise ValueError(
+                f"Roster of {len(final_participants)} exceeds {training.max_participants} seats")
+
+        to_add = final_participants - participants
+        to_remove = participants - final_participants
+        Reservation.objects.bulk_create([
+            Reservation(training_id=training_id, user_id=user_id, **Reservation.deadlines(training.date))
+            for user_id in to_add
+        ])
+        if to_remove:
+            Reservation.objects.filter(
+                training_id=training_id, user_id__in=to_remove).delete()
+        if to_add or to_remove:
+            Training.objects.filter(pk=training_id).update(
+                current_participants=F('current_participants') + len(to_add) - len(to_remove))
+
+        reserve_remove = reserve - final_reserve
+        reserve_add = final_reserve - reserve
+        if reserve_remove:
+            WaitlistEntry.objects.filter(
+                training_id=training_id, user_id__in=reserve_remove).delete()
+        if reserve_add:
+            priorities = dict(
+                Subscription.objects.filter(user_id__in=reserve_add, is_paid=True)
+                .values('user_id').annotate(priority=Max('reserve_priority'))
+                .values_list('user_id', 'priority'))
+            priority_users = set(training.priority_participants.filter(
+                pk__in=reserve_add).values_list('pk', flat=True))
+            WaitlistEntry.objects.bulk_create([
+                WaitlistEntry(
+                    training_id=training_id,
+                    user_id=user_id,
+                    is_priority=user_id in priority_users,
+                    priority=priorities.get(user_id, 0),
+                )
+                for user_id in sorted(reserve_add)
+            ])
+
+        # Освобождённые места получают те, кого эта пачка операций не касалась
+        if len(final_participants) < training.max_participants:
+            promote_waitlist(
+                [training_id], exclude_user_ids={user_id for _, user_id in operations})
+
+    logger.info(
+        f"Roster of training {training_id} updated: +{len(to_add)} -{len(to_remove)}, "
+        f"reserve +{len(reserve_add)} -{len(reserve_remove)}")
@@ -0,0 +1,29 @@
+import datetime
+
+import django_filters
+
+from .models import Training
+from .utils import start_of_day
+
+
+class TrainingFilter(django_filters.FilterSet):
+    gym = django_filters.NumberFilter(field_name='gym_id')
+    trainer = django_filters.NumberFilter(field_name='trainer_id')
+    level = django_filters.NumberFilter(field_name='level')
+    gender = django_filters.ChoiceFilter(
+        field_name='gender', choices=Training.GENDER_CHOICES)
+    date_from = django_filters.DateFilter(method='filter_date_from')
+    date_to = django_filters.DateFilter(method='filter_date_to')
+
+    class Meta:
+        model = Training
+        fields = ['gym', 'trainer', 'level', 'gender', 'date_from', 'date_to']
+
+    # Границы дня переводим в datetime, чтобы фильтр шёл по индексу на date,
+    # а не по date__date (приведение типа индекс не использует)
+    def filter_date_from(self, queryset, name, value):
+        return queryset.filter(date__gte=start_of_day(value))
+
+    def filter_date_to(self, queryset, name, value):
+        return queryset.filter(date__lt=start_of_day(value + datetime.timedelta(days=1)))
+
@@ -0,0 +1,127 @@
+import functools
+import hashlib
+import json
+import logging
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError
+from django.db.models import Q
+from django.http import QueryDict
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+
+
+def idempotent(view_method):
+    """
+    Декоратор метода APIView: повтор запроса с тем же заголовком Idempotency-Key
+    (тот же пользователь, метод и путь) отдаёт сохранённый ответ, не выполняя
+    view повторно. Ответы 5xx не сохраняются, чтобы запрос можно было повторить.
+    Повтор с тем же ключом, но другим телом получает 422. Ключ, запрос по
+    которому завершился падением процесса, после IDEMPOTENCY_KEY_LEASE
+    забирает следующий повтор.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        header = request.META.get(IDEMPOTENCY_HEADER)
+        if not header:
+            return view_method(self, request, *args, **kwargs)
+        if len(header) > MAX_KEY_LENGTH:
+            return Response({'error': 'Слишком длинный Idempotency-Key'}, status=status.HTTP_400_BAD_REQUEST)
+
+        key = _digest(request, header)
+        request_hash = _fingerprint(request)
+        now = timezone.now()
+        stored = IdempotencyKey.objects.filter(
+            key=key, expires_at__gt=now).first()
+        if stored is None:
+            # Занимаем ключ до выполнения view: параллельный повтор получит 409
+            IdempotencyKey.objects.filter(key=key, expires_at__lte=now).delete()
+            try:
+                IdempotencyKey.objects.create(
+                    key=key, request_hash=request_hash,
+                    expires_at=now + settings.IDEMPOTENCY_KEY_TTL,
+                    locked_until=now + settings.IDEMPOTENCY_KEY_LEASE)
+            except IntegrityError:
+                stored = IdempotencyKey.objects.filter(key=key).first()
+                if stored is None:
+                    return _in_progress()
+
+        if stored is not None:
+            if stored.request_hash and stored.request_hash != request_hash:
+                return Response({'error': 'Idempotency-Key уже использован с другим телом запроса'},
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if stored.status_code is not None:
+                return _replay(stored)
+            if not _take_over(stored, now):
+                return _in_progress()
+            logger.warning(f"Taking over stale idempotency key {stored.key}")
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            IdempotencyKey.objects.filter(key=key).delete()
+            raise
+
+        if response.status_code >= 500 or not hasattr(response, 'data'):
+            IdempotencyKey.objects.filter(key=key).delete()
+        else:
+            IdempotencyKey.objects.filter(key=key).update(
+                status_code=response.status_code, response=response.data, locked_until=None)
+        return response
+
+    return wrapper
+
+
+def _digest(request, header):
+    user_id = request.user.pk if request.user.is_authenticated else 'anonymous'
+    scope = f"{user_id}:{request.method}:{request.path}:{header}"
+    return hashlib.sha256(scope.encode()).hexdigest()
+
+
+def _fingerprint(request):
+    """
+    sha256 тела запроса в каноническом виде: для JSON порядок ключей
+    и пробелы не важны. Тело читается через request.body до разбора DRF:
+    оно кэшируется, и view, которые сами читают request.body, продолжают
+    работать. Тело не в JSON (формы, файлы) берётся из request.data.
+    """
+    try:
+        data = json.loads(request.body or b'null')
+    except ValueError:
+        data = request.data
+        if isinstance(data, QueryDict):
+            data = dict(data.lists())
+    body = json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder, default=str)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def _take_over(stored, now):
+    """
+    Забирает ключ, запрос по которому не завершился за IDEMPOTENCY_KEY_LEASE
+    (процесс упал, не сохранив ответ). Условное обновление: из нескольких
+    параллельных повторов ключ достанется одному.
+    """
+    return IdempotencyKey.objects.filter(
+        Q(locked_until__isnull=True) | Q(locked_until__lte=now),
+        pk=stored.pk, status_code__isnull=True,
+    ).update(locked_until=now + settings.IDEMPOTENCY_KEY_LEASE) == 1
+
+
+def _in_progress():
+    return Response({'error': 'Запрос с этим ключом ещё выполняется'}, status=status.HTTP_409_CONFLICT)
+
+
+def _replay(stored):
+    logger.info(f"Replaying stored response for idempotency key {stored.key}")
+    response = Response(stored.response, status=stored.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
@@ -0,0 +1,70 @@
+import logging
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from .models import Notification, NotificationCounter
+
+logger = logging.getLogger(__name__)
+
+
+def create_notifications(notifications, batch_size=1000):
+    """
+    Сохраняет уведомления одной bulk-вставкой и увеличивает счётчики
+    непрочитанных: недостающие строки счётчиков создаются одним INSERT,
+    приращения применяются одним UPDATE на каждое значение.
+    """
+    if not notifications:
+        return []
+    unread = Counter(notification.user_id for notification in notifications)
+    with transaction.atomic():
+        created = Notification.objects.bulk_create(
+            notifications, batch_size=batch_size)
+        NotificationCounter.objects.bulk_create(
+            [NotificationCounter(user_id=user_id) for user_id in sorted(unread)],
+            ignore_conflicts=True)
+        by_delta = defaultdict(list)
+        for user_id, delta in unread.items():
+            by_delta[delta].append(user_id)
+        for delta, user_ids in by_delta.items():
+            NotificationCounter.objects.filter(pk__in=user_ids).update(
+                unread=F('unread') + delta)
+    logger.info(
+        f"Created {len(created)} notifications for {len(unread)} users")
+    return created
+
+
+def notify(user_ids, type, training=None, **payload):
+    """
+    Рассылает одно уведомление всем user_ids, например участникам
+    отменённой тренировки.
+    """
+    return create_notifications([
+        Notification(user_id=user_id, type=type,
+                     training=training, payload=payload)
+        for user_id in set(user_ids)
+    ])
+
+
+def unread_count(user):
+    counter = NotificationCounter.objects.filter(
+        user=user).values_list('unread', flat=True).first()
+    return counter or 0
+
+
+def mark_read(user, ids=None):
+    """
+    Отмечает прочитанными уведомления ids (или все) и уменьшает счётчик
+    на число действительно изменённых строк. Возвращает это число.
+    """
+    notifications = Notification.objects.filter(user=user, is_read=False)
+    if ids is not None:
+        notifications = notifications.filter(pk__in=ids)
+    with transaction.atomic():
+        marked = notifications.update(is_read=True)
+        if marked:
+            NotificationCounter.objects.filter(user=user).update(
+                unread=Greatest(F('unread') - marked, 0))
+    return marked
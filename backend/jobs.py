@@ -0,0 +1,173 @@
+import datetime
+import functools
+import logging
+import random
+import traceback
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+
+def task(func=None, *, max_attempts=5):
+    """
+    Помечает функцию как фоновую задачу. func.delay(**kwargs) ставит её
+    в очередь; имя задачи — полный путь к функции.
+    """
+    if func is None:
+        return functools.partial(task, max_attempts=max_attempts)
+
+    func.job_name = f"{func.__module__}.{func.__name__}"
+    func.delay = functools.partial(enqueue, func.job_name, max_attempts=max_attempts)
+    return func
+
+
+def enqueue(name, run_at=None, key=None, max_attempts=5, **payload):
+    """
+    Ставит задачу в очередь. Если задача с таким key уже есть, новая не
+    создаётся. Вызванная внутри транзакции, задача появится вместе с её
+    фиксацией и исчезнет при откате.
+    """
+    jobs = Job.objects.bulk_create([Job(
+        name=name,
+        payload=payload,
+        key=key,
+        max_attempts=max_attempts,
+        run_at=run_at or timezone.now(),
+    )], ignore_conflicts=key is not None)
+    return jobs[0]
+
+
+def enqueue_periodic(now=None):
+    """
+    Ставит в очередь периодические задачи JOB_SCHEDULE за текущий слот.
+    Ключ «имя@начало слота» не даёт нескольким воркерам поставить одну
+    задачу дважды; всё делается одним INSERT.
+    """
+    now = now or timezone.now()
+    jobs = []
+    for name, interval in settings.JOB_SCHEDULE.items():
+        seconds = int(interval.total_seconds())
+        slot = datetime.datetime.fromtimestamp(
+            int(now.timestamp()) // seconds * seconds, tz=datetime.timezone.utc)
+        jobs.append(Job(name=name, key=f"{name}@{slot.isoformat()}", run_at=slot))
+    Job.objects.bulk_create(jobs, ignore_conflicts=True)
+
+
+def claim_jobs(worker, limit=10):
+    """
+    Арендует до limit готовых задач: поставленные в очередь с наступившим
+    run_at и задачи с истёкшей арендой (воркер упал). SKIP LOCKED позволяет
+    нескольким воркерам разбирать очередь, не дожидаясь друг друга.
+    Задача, которая max_attempts раз осталась с истёкшей арендой (например,
+    роняет воркер), больше не выдаётся и переводится в failed.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(Q(status='queued', run_at__lte=now) | Q(status='running', locked_until__lt=now))
+            .order_by('run_at')[:limit]
+        )
+        lost = [job for job in jobs if job.status == 'running' and job.attempts >= job.max_attempts]
+        if lost:
+            for job in lost:
+                logger.error(
+                    f"Job {job.id} {job.name} lost its lease after {job.attempts} attempts, giving up")
+            Job.objects.filter(pk__in=[job.pk for job in lost]).update(
+                status='failed', locked_until=None, finished_at=now,
+                last_error='Lease expired: the worker running the job was lost')
+            jobs = [job for job in jobs if job not in lost]
+        if not jobs:
+            return []
+        locked_until = now + settings.JOB_LEASE
+        for job in jobs:
+            job.status = 'running'
+            job.attempts += 1
+            job.locked_until = locked_until
+            job.locked_by = worker
+        Job.objects.bulk_update(
+            jobs, ['status', 'attempts', 'locked_until', 'locked_by'])
+    return jobs
+
+
+def retry_delay(attempts):
+    """
+    Экспоненциальная задержка перед повтором с разбросом, чтобы упавшие
+    вместе задачи не перезапускались одновременно.
+    """
+    delay = settings.JOB_RETRY_BACKOFF * (2 ** (attempts - 1))
+    delay = min(delay, settings.JOB_RETRY_BACKOFF_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def run_job(job):
+    """
+    Выполняет арендованную задачу и записывает результат. Условие по
+    locked_by не даёт перезаписать задачу, которую после истечения аренды
+    уже забрал другой воркер.
+    """
+    now = timezone.now()
+    owned = Job.objects.filter(pk=job.pk, status='running', locked_by=job.locked_by)
+    try:
+        func = import_string(job.name)
+    except ImportError:
+        func = None
+    if not hasattr(func, 'job_name'):
+        # Повтор не поможет: такой задачи нет в коде
+        error = f"{job.name} is not a registered task"
+        logger.error(f"Job {job.id}: {error}")
+        owned.update(status='failed', last_error=error,
+                     locked_until=None, finished_at=timezone.now())
+        return False
+
+    try:
+        func(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            logger.error(
+                f"Job {job.id} {job.name} failed after {job.attempts} attempts: {error}")
+            owned.update(status='failed', last_error=error,
+                         locked_until=None, finished_at=timezone.now())
+        else:
+            run_at = timezone.now() + retry_delay(job.attempts)
+            logger.warning(
+                f"Job {job.id} {job.name} failed (attempt {job.attempts}), retry at {run_at}: {error}")
+            owned.update(status='queued', last_error=error,
+                         locked_until=None, run_at=run_at)
+        return False
+
+    owned.update(status='done', locked_until=None, finished_at=timezone.now())
+    logger.info(
+        f"Job {job.id} {job.name} done in {(timezone.now() - now).total_seconds():.2f}s")
+    return True
+
+
+def work(worker, stop, batch_size=10, poll_interval=1.0):
+    """
+    Цикл воркера: арендует пачку задач и выполняет их по очереди, пока не
+    выставлено событие stop. При пустой очереди ждёт poll_interval секунд.
+    """
+    while not stop.is_set():
+        close_old_connections()
+        try:
+            jobs = claim_jobs(worker, batch_size)
+        except Exception as e:
+            logger.error(f"Worker {worker} failed to claim jobs: {e}")
+            jobs = []
+        for job in jobs:
+            try:
+                run_job(job)
+            except Exception as e:
+                # Результат не записан — задачу подберут после истечения аренды
+                logger.error(f"Worker {worker} lost job {job.id}: {e}")
+        if not jobs:
+            stop.wait(poll_interval)
+    connection.close()
@@ -0,0 +1,92 @@
+import logging
+import smtplib
+import time
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+logger = logging.getLogger(__name__)
+
+
+def is_transient(error):
+    """
+    Временная ошибка SMTP: обрыв или отказ соединения, таймаут, ответ 4xx.
+    Такие ошибки повторяются через новое соединение; остальные (5xx, отказ
+    всех получателей) — нет.
+    """
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    # SMTPException наследует OSError, поэтому проверяется до сетевых ошибок
+    if isinstance(error, smtplib.SMTPException):
+        return False
+    return isinstance(error, OSError)
+
+
+@dataclass
+class SendResult:
+    """
+    Итог отправки: число доставленных писем и неотправленные из-за ошибки
+    соединения в виде {индекс письма в списке: ошибка}. Письма с постоянной
+    ошибкой в failed не попадают — повтор их не исправит.
+    """
+    sent: int = 0
+    failed: dict = field(default_factory=dict)
+
+
+def send_messages(messages, chunk_size=None, retries=None, backoff=None, connection=None):
+    """
+    Отправляет EmailMessage пачками по chunk_size через одно соединение на
+    пачку вместо соединения на каждое письмо. Письма внутри пачки уходят по
+    одному, поэтому после временной ошибки отправка продолжается с того же
+    письма через новое соединение (до retries раз с экспоненциальной
+    задержкой). Письмо с постоянной ошибкой пропускается. Если попытки
+    исчерпаны, оставшиеся письма не отправляются и попадают в failed —
+    вызывающий код повторит только их, не дублируя уже доставленные.
+    Возвращает SendResult.
+    """
+    chunk_size = chunk_size or settings.MAIL_CHUNK_SIZE
+    retries = settings.MAIL_RETRIES if retries is None else retries
+    backoff = settings.MAIL_RETRY_BACKOFF if backoff is None else backoff
+    connection = connection or get_connection()
+
+    result = SendResult()
+    started = time.monotonic()
+    position = 0
+    while position < len(messages):
+        chunk_end = min(position + chunk_size, len(messages))
+        attempt = 0
+        while position < chunk_end:
+            try:
+                connection.open()
+                while position < chunk_end:
+                    try:
+                        result.sent += connection.send_messages([messages[position]])
+                    except Exception as e:
+                        if is_transient(e):
+                            raise
+                        logger.error(
+                            f"Dropping mail to {messages[position].to}: {e}")
+                    position += 1
+            except Exception as e:
+                if not is_transient(e) or attempt >= retries:
+                    # Сервер недоступен или отказал в соединении: остальные
+                    # пачки не ждут своих повторов
+                    logger.error(
+                        f"SMTP error after {result.sent} messages, {len(messages) - position} not sent: {e}")
+                    result.failed = {index: str(e) for index in range(position, len(messages))}
+                    return result
+                attempt += 1
+                delay = backoff * (2 ** (attempt - 1))
+                logger.warning(
+                    f"SMTP error after {result.sent} messages, retry {attempt} in {delay:.1f}s: {e}")
+                time.sleep(delay)
+            finally:
+                connection.close()
+
+    if result.sent:
+        logger.info(
+            f"Sent {result.sent} of {len(messages)} messages in {time.monotonic() - started:.2f}s")
+    return result
@@ -0,0 +1,95 @@
+import socketserver
+import threading
+import time
+
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand
+
+from backend.mail import send_messages
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """
+    Минимальный SMTP-сервер для замеров: принимает любые письма и никуда их
+    не отправляет. Задержка на приветствии имитирует стоимость установки
+    соединения (TCP+TLS) у настоящего сервера.
+    """
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        time.sleep(self.server.handshake_delay)
+        self.reply('220 localhost ESMTP bench')
+        for raw in self.rfile:
+            command = raw.decode(errors='replace').strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self.reply('250 localhost')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                for line in self.rfile:
+                    if line in (b'.\r\n', b'.\n'):
+                        break
+                self.server.received += 1
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                break
+            else:
+                self.reply('250 OK')
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, handshake_delay):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.handshake_delay = handshake_delay
+        self.received = 0
+
+
+class Command(BaseCommand):
+    help = 'Замеряет скорость отправки писем (писем в секунду) на локальном SMTP-сервере: send_mail на каждое письмо против backend.mail.send_messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=500,
+                            help='Сколько писем отправить в каждом замере')
+        parser.add_argument('--chunk-size', type=int, default=100,
+                            help='Писем на одно соединение для send_messages')
+        parser.add_argument('--handshake-ms', type=float, default=20.0,
+                            help='Задержка установки соединения на сервере, мс')
+
+    def handle(self, *args, **options):
+        server = SMTPServer(options['handshake_ms'] / 1000)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host, port = server.server_address
+
+        def connection():
+            return get_connection('django.core.mail.backends.smtp.EmailBackend', host=host, port=port,
+                                  username='', password='', use_tls=False, use_ssl=False)
+
+        messages = [
+            EmailMessage('Бенчмарк', f'Письмо {number}', 'bench@localhost', [f'user{number}@localhost'])
+            for number in range(options['messages'])
+        ]
+        try:
+            started = time.monotonic()
+            for message in messages:
+                # Как send_mail: новое соединение на каждое письмо
+                message.connection = connection()
+                message.send()
+            self.report('per-message connection', len(messages), time.monotonic() - started)
+
+            for message in messages:
+                message.connection = None
+            started = time.monotonic()
+            result = send_messages(messages, chunk_size=options['chunk_size'], connection=connection())
+            self.report(f"send_messages, chunk {options['chunk_size']}", result.sent, time.monotonic() - started)
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.stdout.write(f"Server received {server.received} messages")
+
+    def report(self, label, sent, elapsed):
+        self.stdout.write(f"{label}: {sent} messages in {elapsed:.2f}s, {sent / elapsed:.0f} msg/s")
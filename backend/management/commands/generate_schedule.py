@@ -0,0 +1,33 @@
+import datetime
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from backend.recurrence import generate_schedule
+
+
+class Command(BaseCommand):
+    help = 'Досоздаёт повторения серий тренировок на горизонт в несколько недель вперёд (идемпотентно)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--weeks', type=int, default=settings.SCHEDULE_HORIZON_WEEKS,
+                            help='Горизонт в неделях (по умолчанию SCHEDULE_HORIZON_WEEKS)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Показать недостающие повторения, ничего не создавая')
+
+    def handle(self, *args, **options):
+        until = timezone.localdate() + datetime.timedelta(weeks=options['weeks'])
+        occurrences = generate_schedule(until, dry_run=options['dry_run'])
+
+        by_series = defaultdict(list)
+        for occurrence in occurrences:
+            by_series[occurrence.parent_training_id].append(occurrence.occurrence_date)
+        for series_id, days in sorted(by_series.items()):
+            self.stdout.write(
+                f"Серия {series_id}: +{len(days)} ({', '.join(day.isoformat() for day in days)})")
+
+        verb = 'Будет создано' if options['dry_run'] else 'Создано'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} повторений: {len(occurrences)} в {len(by_series)} сериях, горизонт до {until}"))
@@ -0,0 +1,134 @@
+import datetime
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from backend.enrollment import (
+    SubscriptionSlot, TrainingSlot, SUBSCRIPTION_SLOT_FIELDS, TRAINING_SLOT_FIELDS,
+    allocate_seats, apply_allocations, subscription_slot, training_slot,
+)
+from backend.models import Reservation, Subscription, Training
+from backend.utils import start_of_day
+
+
+class Command(BaseCommand):
+    help = 'Записывает все оплаченные абонементы на тренировки месяца одним проходом распределения мест'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help='Месяц в формате YYYY-MM (по умолчанию текущий)')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Посчитать распределение, ничего не записывая')
+        parser.add_argument('--benchmark', action='store_true',
+                            help='Замерить распределение на синтетических данных без БД')
+        parser.add_argument('--subscriptions', type=int, default=10000)
+        parser.add_argument('--trainings', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        first_day = self.parse_month(options['month'])
+        if options['benchmark']:
+            self.benchmark(first_day, options['subscriptions'], options['trainings'])
+            return
+
+        next_month = (first_day + datetime.timedelta(days=32)).replace(day=1)
+        last_day = next_month - datetime.timedelta(days=1)
+        month_key = first_day.year * 100 + first_day.month
+        timings = {}
+
+        with transaction.atomic():
+            started = time.perf_counter()
+            training_rows = list(
+                Training.objects.select_for_update()
+                .filter(
+                    date__gte=start_of_day(first_day),
+                    date__lt=start_of_day(next_month),
+                    current_participants__lt=F('max_participants'),
+                )
+                .order_by('pk')
+                .values(*TRAINING_SLOT_FIELDS)
+            )
+            subscription_rows = list(
+                Subscription.objects.filter(
+                    Q(months=[]) | Q(months__contains=[month_key]),
+                    is_paid=True,
+                    trainings_left__gt=0,
+                    start_date__lte=last_day,
+                    end_date__gte=first_day,
+                ).values(*SUBSCRIPTION_SLOT_FIELDS)
+            )
+            enrolled = set(Reservation.objects.filter(
+                training_id__in=[row['id'] for row in training_rows],
+            ).values_list('training_id', 'user_id'))
+            timings['load'] = time.perf_counter() - started
+
+            started = time.perf_counter()
+            trainings = sorted((training_slot(row) for row in training_rows),
+                               key=lambda slot: (slot.day, slot.id))
+            allocations = allocate_seats(
+                trainings,
+                [subscription_slot(row) for row in subscription_rows],
+                {row['id']: row['trainings_left'] for row in subscription_rows},
+                enrolled,
+            )
+            timings['allocate'] = time.perf_counter() - started
+
+            started = time.perf_counter()
+            if options['dry_run']:
+                transaction.set_rollback(True)
+            else:
+                apply_allocations(allocations)
+            timings['write'] = time.perf_counter() - started
+
+        self.stdout.write(
+            f"{first_day:%Y-%m}: {len(subscription_rows)} subscriptions x {len(training_rows)} trainings, "
+            f"{len(allocations)} enrollments{' (dry run)' if options['dry_run'] else ''}")
+        self.report(timings)
+
+    def benchmark(self, first_day, subscription_count, training_count):
+        rng = random.Random(0)
+        month_key = first_day.year * 100 + first_day.month
+        days = [first_day + datetime.timedelta(days=offset) for offset in range(28)]
+        gyms, levels, genders = range(1, 21), range(1, 6), ('male', 'female')
+
+        trainings = sorted((
+            TrainingSlot(
+                id=pk, gym_id=rng.choice(gyms), level=rng.choice(levels),
+                gender=rng.choice(('any', 'any', 'male', 'female')), day=day,
+                weekday=day.weekday(), month_key=month_key, free=rng.randint(4, 16),
+            )
+            for pk, day in ((pk, rng.choice(days)) for pk in range(1, training_count + 1))
+        ), key=lambda slot: (slot.day, slot.id))
+        subscriptions = [
+            SubscriptionSlot(
+                id=pk, user_id=pk, gym_id=rng.choice(gyms), level=rng.choice(levels),
+                gender=rng.choice(genders), weekday_mask=rng.choice((0, 0b0010101, 0b0101010, 0b1100000)),
+                months=frozenset() if rng.random() < 0.5 else frozenset({month_key}),
+                start_date=days[0], end_date=days[-1], priority=rng.randint(0, 3),
+            )
+            for pk in range(1, subscription_count + 1)
+        ]
+        seats_left = {subscription.id: rng.choice((4, 8, 12)) for subscription in subscriptions}
+
+        started = time.perf_counter()
+        allocations = allocate_seats(trainings, subscriptions, seats_left)
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f"Synthetic {subscription_count} subscriptions x {training_count} trainings: "
+            f"{len(allocations)} enrollments")
+        self.report({'allocate': elapsed})
+
+    def report(self, timings):
+        for phase, seconds in timings.items():
+            self.stdout.write(f"  {phase}: {seconds * 1000:.1f} ms")
+
+    def parse_month(self, value):
+        if not value:
+            return timezone.localdate().replace(day=1)
+        try:
+            return datetime.datetime.strptime(value, '%Y-%m').date()
+        except ValueError:
+            raise CommandError('Month must be given as YYYY-MM')
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from backend.enrollment import process_enrollment_tickets
+from backend.models import EnrollmentTicket
+
+
+class Command(BaseCommand):
+    help = 'Обрабатывает очередь заявок на запись (EnrollmentTicket) пачками по тренировкам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--training', type=int,
+                            help='Обрабатывать только эту тренировку')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--interval', type=float, default=0.5,
+                            help='Пауза в секундах, когда очередь пуста')
+        parser.add_argument('--once', action='store_true',
+                            help='Разобрать текущую очередь и выйти')
+
+    def handle(self, *args, **options):
+        while True:
+            processed = self.drain(options['training'], options['batch_size'])
+            if options['once'] and not processed:
+                return
+            if not processed:
+                time.sleep(options['interval'])
+
+    def drain(self, training_id, batch_size):
+        pending = EnrollmentTicket.objects.filter(status='pending')
+        if training_id:
+            pending = pending.filter(training_id=training_id)
+        processed = 0
+        for pk in pending.values_list('training_id', flat=True).distinct():
+            # None — тренировку держит другой обработчик
+            processed += process_enrollment_tickets(pk, batch_size) or 0
+        if processed:
+            self.stdout.write(f"Processed {processed} tickets")
+        return processed
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from backend.models import Training
+
+
+class Command(BaseCommand):
+    help = 'Сверяет Training.current_participants с фактическим составом и исправляет расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать расхождения, ничего не меняя')
+
+    def handle(self, *args, **options):
+        actual = Coalesce(Subquery(
+            Training.participants.through.objects
+            .filter(training_id=OuterRef('pk'))
+            .values('training_id')
+            .annotate(total=Count('*'))
+            .values('total')
+        ), 0)
+
+        drifted = Training.objects.annotate(actual=actual).exclude(
+            current_participants=F('actual'))
+
+        if options['dry_run']:
+            for training_id, stored, real in drifted.values_list('id', 'current_participants', 'actual'):
+                self.stdout.write(
+                    f"Training {training_id}: stored {stored}, actual {real}")
+            self.stdout.write(f"Found {drifted.count()} drifted trainings")
+            return
+
+        updated = Training.objects.filter(
+            pk__in=drifted.values('pk')).update(current_participants=actual)
+        self.stdout.write(self.style.SUCCESS(
+            f"Reconciled {updated} trainings"))
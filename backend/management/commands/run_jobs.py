@@ -0,0 +1,60 @@
+import logging
+import os
+import signal
+import socket
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from backend import tasks  # noqa: F401 — регистрирует задачи
+from backend.jobs import enqueue_periodic, work
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Запускает воркеры фоновой очереди задач (таблица Job) и планировщик периодических задач'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2,
+                            help='Число параллельных воркеров')
+        parser.add_argument('--batch-size', type=int, default=10,
+                            help='Сколько задач воркер арендует за раз')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Пауза в секундах, когда очередь пуста')
+        parser.add_argument('--no-schedule', action='store_true',
+                            help='Не ставить периодические задачи JOB_SCHEDULE')
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stop.set())
+
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+        threads = [
+            threading.Thread(
+                target=work,
+                args=(f"{prefix}:{number}", stop, options['batch_size'], options['interval']),
+                daemon=True,
+            )
+            for number in range(options['workers'])
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f"Started {len(threads)} workers ({prefix})")
+
+        while not stop.is_set():
+            if not options['no_schedule']:
+                # Сбой базы не должен останавливать планировщик и воркеры
+                close_old_connections()
+                try:
+                    enqueue_periodic()
+                except Exception as e:
+                    logger.error(f"Failed to enqueue periodic jobs: {e}")
+            stop.wait(options['interval'])
+
+        for thread in threads:
+            thread.join()
+        connection.close()
+        self.stdout.write('Workers stopped')
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.3 on 2026-10-18 06:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0029_remove_training_confirmed_participants_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='training',
+            index=models.Index(fields=['gym', 'date'], name='training_gym_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='training',
+            index=models.Index(fields=['date', 'level', 'gender'], name='training_date_level_gender_idx'),
+        ),
+    ]
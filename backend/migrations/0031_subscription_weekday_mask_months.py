@@ -0,0 +1,51 @@
+# Generated by Django 4.2.3 on 2026-10-18 06:51
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+DAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+
+def fill_weekday_mask_and_months(apps, schema_editor):
+    Subscription = apps.get_model('backend', 'Subscription')
+    subscriptions = list(Subscription.objects.only('days_of_week', 'month'))
+    for subscription in subscriptions:
+        mask = 0
+        for day in subscription.days_of_week.split(','):
+            day = day.strip().lower()
+            if day in DAYS:
+                mask |= 1 << DAYS.index(day)
+        keys = set()
+        for item in subscription.month.split(','):
+            try:
+                year, month = (int(part) for part in item.strip().split('-'))
+            except ValueError:
+                continue
+            if 1 <= month <= 12:
+                keys.add(year * 100 + month)
+        subscription.weekday_mask = mask
+        subscription.months = sorted(keys)
+    Subscription.objects.bulk_update(
+        subscriptions, ['weekday_mask', 'months'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0030_training_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscription',
+            name='months',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.PositiveIntegerField(), blank=True, default=list, size=None),
+        ),
+        migrations.AddField(
+            model_name='subscription',
+            name='weekday_mask',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_weekday_mask_and_months,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_reserve_participants(apps, schema_editor):
+    Training = apps.get_model('backend', 'Training')
+    Subscription = apps.get_model('backend', 'Subscription')
+    WaitlistEntry = apps.get_model('backend', 'WaitlistEntry')
+    Reserve = Training.reserve_participants.through
+    Priority = Training.priority_participants.through
+
+    priorities = {}
+    for user_id, priority in Subscription.objects.filter(is_paid=True).values_list('user_id', 'reserve_priority'):
+        priorities[user_id] = max(priority, priorities.get(user_id, priority))
+    priority_pairs = set(Priority.objects.values_list(
+        'training_id', 'customuser_id'))
+
+    WaitlistEntry.objects.bulk_create([
+        WaitlistEntry(
+            training_id=training_id,
+            user_id=user_id,
+            is_priority=(training_id, user_id) in priority_pairs,
+            priority=priorities.get(user_id, 0),
+        )
+        for training_id, user_id in Reserve.objects.order_by('id').values_list('training_id', 'customuser_id')
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0031_subscription_weekday_mask_months'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WaitlistEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_priority', models.BooleanField(default=False)),
+                ('priority', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('training', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='waitlist', to='backend.training')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='waitlistentry',
+            constraint=models.UniqueConstraint(fields=('training', 'user'), name='waitlist_training_user_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='waitlistentry',
+            index=models.Index(fields=['training', '-is_priority', '-priority', 'id'], name='waitlist_next_in_line_idx'),
+        ),
+        migrations.RunPython(copy_reserve_participants, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='training',
+            name='reserve_participants',
+        ),
+        migrations.AddField(
+            model_name='training',
+            name='reserve_participants',
+            field=models.ManyToManyField(blank=True, related_name='reserve_trainings', through='backend.WaitlistEntry', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
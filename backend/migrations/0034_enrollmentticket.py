@@ -0,0 +1,39 @@
+# Generated by Django 4.2.3 on 2026-10-18 06:55
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0033_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='training',
+            name='queued_enrollment',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='EnrollmentTicket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('enrolled', 'Enrolled'), ('reserved', 'Reserved'), ('rejected', 'Rejected')], default='pending', max_length=10)),
+                ('detail', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('training', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='enrollment_tickets', to='backend.training')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['training', 'status', 'id'], name='ticket_queue_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='enrollmentticket',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('training', 'user'), name='ticket_one_pending_per_user'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.3 on 2026-10-18 06:58
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0034_enrollmentticket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='training',
+            name='recurrence_exdates',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.DateField(), blank=True, default=list, size=None),
+        ),
+        migrations.AddField(
+            model_name='training',
+            name='recurrence_rule',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.3 on 2026-10-18 07:00
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_occurrence_dates(apps, schema_editor):
+    # День повторения — локальная дата тренировки; при дублях в одной серии
+    # день получает только первая запись, чтобы не нарушить уникальность
+    schema_editor.execute(
+        '''
+        UPDATE backend_training SET occurrence_date = (date AT TIME ZONE %s)::date
+        WHERE id IN (
+            SELECT DISTINCT ON (parent_training_id, (date AT TIME ZONE %s)::date) id
+            FROM backend_training
+            WHERE parent_training_id IS NOT NULL
+            ORDER BY parent_training_id, (date AT TIME ZONE %s)::date, id
+        )
+        ''',
+        [settings.TIME_ZONE] * 3,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0035_training_recurrence_rule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='training',
+            name='lazy_occurrences',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='training',
+            name='occurrence_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_occurrence_dates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='training',
+            constraint=models.UniqueConstraint(fields=('parent_training', 'occurrence_date'), name='training_series_occurrence_uniq'),
+        ),
+    ]
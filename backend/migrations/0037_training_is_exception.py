@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2026-10-18 07:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0036_training_lazy_occurrences'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='training',
+            name='is_exception',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,72 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+REMIND_BEFORE = django.utils.timezone.timedelta(days=2, hours=12)
+CONFIRMATION_WINDOW = django.utils.timezone.timedelta(hours=3)
+
+
+def copy_participants(apps, schema_editor):
+    Training = apps.get_model('backend', 'Training')
+    Reservation = apps.get_model('backend', 'Reservation')
+    Participants = Training.participants.through
+    now = django.utils.timezone.now()
+
+    reservations = []
+    for training_id, user_id, training_date in Participants.objects.order_by('id').values_list(
+            'training_id', 'customuser_id', 'training__date'):
+        remind_at = training_date - REMIND_BEFORE
+        reservations.append(Reservation(
+            training_id=training_id,
+            user_id=user_id,
+            remind_at=remind_at,
+            expire_at=remind_at + CONFIRMATION_WINDOW,
+            # Старая рассылка уже напоминала о подтверждении на каждом запуске
+            reminded_at=now if remind_at <= now else None,
+        ))
+    Reservation.objects.bulk_create(reservations, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0037_training_is_exception'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Reservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('remind_at', models.DateTimeField(blank=True, null=True)),
+                ('expire_at', models.DateTimeField(blank=True, null=True)),
+                ('reminded_at', models.DateTimeField(blank=True, null=True)),
+                ('training', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='backend.training')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='reservation',
+            constraint=models.UniqueConstraint(fields=('training', 'user'), name='reservation_training_user_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(condition=models.Q(('reminded_at__isnull', True)), fields=['remind_at'], name='reservation_remind_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['expire_at'], name='reservation_expire_idx'),
+        ),
+        migrations.RunPython(copy_participants, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='training',
+            name='participants',
+        ),
+        migrations.AddField(
+            model_name='training',
+            name='participants',
+            field=models.ManyToManyField(blank=True, related_name='trainings', through='backend.Reservation', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+import django.utils.timezone
+
+
+def fill_status_and_subscription(apps, schema_editor):
+    Reservation = apps.get_model('backend', 'Reservation')
+    Subscription = apps.get_model('backend', 'Subscription')
+    paid = Subscription.objects.filter(
+        user_id=OuterRef('user_id'), is_paid=True).order_by('id')
+
+    Reservation.objects.update(subscription_id=Subquery(paid.values('id')[:1]))
+    # Раньше подтверждение было одним флагом на абонементе пользователя
+    Reservation.objects.filter(user_id__in=Subscription.objects.filter(
+        is_paid=True, confirmed=True).values('user_id')).update(
+        status='confirmed', confirmed_at=django.utils.timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0039_reservation_status'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_status_and_subscription, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='subscription',
+            name='confirmed',
+        ),
+    ]
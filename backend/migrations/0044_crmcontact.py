@@ -0,0 +1,24 @@
+# Generated by Django 4.2.3 on 2026-10-18 07:16
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0043_notification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CrmContact',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='crm_contact', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('contact_id', models.BigIntegerField(unique=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,81 @@
+from collections import defaultdict
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+from django.db import migrations
+
+
+def flatten_series_chains(apps, schema_editor):
+    """
+    Старый генератор строил цепочки: parent_training повторения указывал на
+    предыдущее повторение, а не на голову серии. Все повторения
+    переназначаются на голову, дубли одного дня серии схлопываются: день
+    остаётся за головой, затем за тренировкой с записями, затем за меньшим
+    id. Дубли без записей удаляются, с записями — отвязываются от дня
+    (occurrence_date = NULL, is_exception), чтобы не потерять участников.
+    """
+    Training = apps.get_model('backend', 'Training')
+    Reservation = apps.get_model('backend', 'Reservation')
+
+    parents = dict(Training.objects.filter(
+        parent_training__isnull=False).values_list('id', 'parent_training_id'))
+    if not parents:
+        return
+
+    def root_of(pk):
+        seen = set()
+        while pk in parents and pk not in seen:
+            seen.add(pk)
+            pk = parents[pk]
+        return pk
+
+    roots = {pk: root_of(pk) for pk in parents}
+    tz = ZoneInfo(settings.TIME_ZONE)
+    trainings = {
+        training.pk: training for training in Training.objects.filter(
+            pk__in=set(parents) | set(roots.values())).only('id', 'date', 'parent_training_id', 'occurrence_date', 'is_exception')
+    }
+    booked = set(Reservation.objects.filter(
+        training_id__in=trainings).values_list('training_id', flat=True).distinct())
+
+    groups = defaultdict(list)
+    for pk, training in trainings.items():
+        root = roots.get(pk, pk)
+        day = training.occurrence_date or training.date.astimezone(tz).date()
+        groups[(root, day)].append(pk)
+
+    changed, removed = [], []
+    for (root, day), members in groups.items():
+        members.sort(key=lambda pk: (pk != root, pk not in booked, pk))
+        for position, pk in enumerate(members):
+            if pk == root:
+                continue
+            training = trainings[pk]
+            if position == 0:
+                target = (root, day, training.is_exception)
+            elif pk in booked:
+                target = (root, None, True)
+            else:
+                removed.append(pk)
+                continue
+            if (training.parent_training_id, training.occurrence_date, training.is_exception) != target:
+                training.parent_training_id, training.occurrence_date, training.is_exception = target
+                changed.append(training)
+
+    # Сначала освобождаем дни, иначе переназначение наткнётся на уникальность
+    # (parent_training, occurrence_date)
+    Training.objects.filter(pk__in=[training.pk for training in changed] + removed).update(occurrence_date=None)
+    Training.objects.filter(pk__in=removed).delete()
+    Training.objects.bulk_update(
+        changed, ['parent_training', 'occurrence_date', 'is_exception'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0044_crmcontact'),
+    ]
+
+    operations = [
+        migrations.RunPython(flatten_series_chains, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2026-10-18 07:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0045_flatten_series_chains'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxevent',
+            name='locked_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.3 on 2026-10-18 07:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backend', '0047_idempotency_lease_and_request_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customuser',
+            name='gender',
+            field=models.CharField(blank=True, choices=[('any', 'any'), ('male', 'male'), ('female', 'female')], max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='customuser',
+            name='photo',
+            field=models.ImageField(blank=True, null=True, upload_to='user_photos/'),
+        ),
+        migrations.AlterField(
+            model_name='gym',
+            name='photo',
+            field=models.ImageField(blank=True, null=True, upload_to='gym_photos/'),
+        ),
+    ]
@@ -1,11 +1,13 @@
-from django.db import models
+from django.db import models, transaction
+from django.core.serializers.json import DjangoJSONEncoder
+from django.contrib.postgres.fields import ArrayField
 from django.contrib.auth.models import AbstractUser
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, m2m_changed
 from django.dispatch import receiver
 from django.contrib.auth.base_user import BaseUserManager
 from django.utils import timezone
 import logging
-from django.db.models import Q
+from django.db.models import F, Max, Q
 logger = logging.getLogger(__name__)
 
 
@@ -134,25 +136,63 @@ class Training(models.Model):
     unenroll_deadline = models.DateTimeField(null=True, blank=True)
     intensity = models.IntegerField(null=True, blank=True)
     participants = models.ManyToManyField(
-        CustomUser, related_name='trainings', blank=True)
+        CustomUser, through='Reservation', related_name='trainings', blank=True)
     is_recurring = models.BooleanField(default=False)
     recurrence_end_date = models.DateField(null=True, blank=True)
+    # Правило повторения в духе RRULE (см. recurrence.RecurrenceRule) и исключённые дни
+    recurrence_rule = models.CharField(max_length=255, blank=True)
+    recurrence_exdates = ArrayField(
+        models.DateField(), default=list, blank=True)
     parent_training = models.ForeignKey(
         'self', null=True, blank=True, on_delete=models.SET_NULL, related_name='recurring_trainings')
+    # День серии, которому соответствует повторение (уникален в пределах серии)
+    occurrence_date = models.DateField(null=True, blank=True)
+    # Повторения серии не создаются заранее, а разворачиваются при чтении
+    # (recurrence.virtual_occurrences) и сохраняются по требованию
+    lazy_occurrences = models.BooleanField(default=False)
+    # Повторение отредактировано отдельно и не меняется правками всей серии
+    is_exception = models.BooleanField(default=False)
     gender = models.CharField(
         max_length=10, choices=GENDER_CHOICES, default='any')  # Добавленное поле
     reserve_participants = models.ManyToManyField(
-        CustomUser, related_name='reserve_trainings', blank=True)
+        CustomUser, through='WaitlistEntry', related_name='reserve_trainings', blank=True)
     priority_participants = models.ManyToManyField(
         CustomUser, related_name='priority_trainings', blank=True)
+    # Запись через очередь заявок (EnrollmentTicket) для популярных тренировок
+    queued_enrollment = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['gym', 'date'],
+                         name='training_gym_date_idx'),
+            models.Index(fields=['date', 'level', 'gender'],
+                         name='training_date_level_gender_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['parent_training', 'occurrence_date'], name='training_series_occurrence_uniq'),
+        ]
 
     def add_to_reserve(self, user):
-        self.reserve_participants.add(user)
-        self.save()
+        """
+        Ставит пользователя в резерв. Возвращает False, если он уже там.
+        """
+        priority = Subscription.objects.filter(
+            user=user, is_paid=True).aggregate(priority=Max('reserve_priority'))['priority']
+        _, created = WaitlistEntry.objects.get_or_create(
+            training=self,
+            user=user,
+            defaults={
+                'is_priority': self.priority_participants.filter(pk=user.pk).exists(),
+                'priority': priority or 0,
+            },
+        )
+        return created
 
     def add_to_priority(self, user):
         self.priority_participants.add(user)
-        self.save()
+        WaitlistEntry.objects.filter(
+            training=self, user=user).update(is_priority=True)
 
     def __str__(self):
         return f"Training at {self.gym.name} on {self.date}"
@@ -160,26 +200,195 @@ class Training(models.Model):
     def save(self, *args, **kwargs):
         if not self.pk:
             self.current_participants = 0
+        elif kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            # Счётчик меняется только через F() (см. update_current_participants),
+            # поэтому обычное сохранение не перезаписывает его устаревшим значением
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'current_participants'
+            ]
         super().save(*args, **kwargs)
-        self.current_participants = self.participants.count()
-        if self.pk:
-            super().save(update_fields=['current_participants'])
-
-    def create_next_recurring(self):
-        if self.is_recurring and self.recurrence_end_date and self.date.date() + timezone.timedelta(days=7) <= self.recurrence_end_date:
-            next_date = self.date + timezone.timedelta(days=7)
-            Training.objects.create(
-                gym=self.gym,
-                trainer=self.trainer,
-                date=next_date,
-                level=self.level,
-                max_participants=self.max_participants,
-                intensity=self.intensity,
-                is_recurring=True,
-                recurrence_end_date=self.recurrence_end_date,
-                parent_training=self,
-                gender=self.gender
-            )
+
+
+class WaitlistEntry(models.Model):
+    """
+    Место в резерве тренировки. Очередь: сначала priority_participants, затем
+    по reserve_priority абонемента, затем по времени постановки (id).
+    """
+    training = models.ForeignKey(
+        Training, on_delete=models.CASCADE, related_name='waitlist')
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    is_priority = models.BooleanField(default=False)
+    priority = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['training', 'user'], name='waitlist_training_user_uniq'),
+        ]
+        indexes = [
+            # Следующий в очереди — первая строка этого индекса для тренировки
+            models.Index(fields=['training', '-is_priority', '-priority', 'id'],
+                         name='waitlist_next_in_line_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.email} in reserve for training {self.training_id}"
+
+
+# Напоминание о подтверждении записи уходит за REMIND_BEFORE до тренировки,
+# неподтверждённая бронь снимается ещё через CONFIRMATION_WINDOW
+CONFIRMATION_REMIND_BEFORE = timezone.timedelta(days=2, hours=12)
+CONFIRMATION_WINDOW = timezone.timedelta(hours=3)
+
+
+class Reservation(models.Model):
+    """
+    Запись пользователя на тренировку (промежуточная таблица participants)
+    со своим состоянием подтверждения. remind_at и expire_at считаются от
+    даты тренировки, reminded_at проставляет рассылка напоминаний.
+    Отменённые записи удаляются.
+    """
+    STATUSES = [
+        ('pending', 'Pending'),
+        ('confirmed', 'Confirmed'),
+    ]
+
+    training = models.ForeignKey(
+        Training, on_delete=models.CASCADE, related_name='reservations')
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    # Абонемент, с которого списано занятие (пусто при ручной записи тренером)
+    subscription = models.ForeignKey(
+        'Subscription', null=True, blank=True, on_delete=models.SET_NULL, related_name='reservations')
+    status = models.CharField(
+        max_length=20, choices=STATUSES, default='pending')
+    created_at = models.DateTimeField(default=timezone.now)
+    confirmed_at = models.DateTimeField(null=True, blank=True)
+    remind_at = models.DateTimeField(null=True, blank=True)
+    expire_at = models.DateTimeField(null=True, blank=True)
+    reminded_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['training', 'user'], name='reservation_training_user_uniq'),
+        ]
+        indexes = [
+            # Очередь напоминаний: только неподтверждённые и ещё не обработанные
+            models.Index(fields=['remind_at'], name='reservation_remind_due_idx',
+                         condition=Q(reminded_at__isnull=True, status='pending')),
+            # Очередь отмены неподтверждённых записей
+            models.Index(fields=['expire_at'], name='reservation_expire_idx',
+                         condition=Q(status='pending')),
+            models.Index(fields=['user', 'status'],
+                         name='reservation_user_status_idx'),
+            models.Index(fields=['training', 'status'],
+                         name='reservation_training_st_idx'),
+        ]
+
+    @staticmethod
+    def deadlines(training_date, now=None):
+        # Записавшийся позже срока напоминания получает его сразу
+        # и полное окно на подтверждение
+        now = now or timezone.now()
+        remind_at = max(training_date - CONFIRMATION_REMIND_BEFORE, now)
+        return {'remind_at': remind_at, 'expire_at': remind_at + CONFIRMATION_WINDOW}
+
+    def confirm(self):
+        """
+        Подтверждает запись. Возвращает False, если она уже подтверждена
+        или снята.
+        """
+        confirmed_at = timezone.now()
+        updated = Reservation.objects.filter(pk=self.pk, status='pending').update(
+            status='confirmed', confirmed_at=confirmed_at)
+        if updated:
+            self.status, self.confirmed_at = 'confirmed', confirmed_at
+        return bool(updated)
+
+    def __str__(self):
+        return f"{self.user_id} enrolled in training {self.training_id}: {self.status}"
+
+
+class EnrollmentTicket(models.Model):
+    """
+    Заявка на запись в очереди тренировки с queued_enrollment. Заявки
+    обрабатываются пачками одним обработчиком на тренировку
+    (enrollment.process_enrollment_tickets), клиент опрашивает статус.
+    """
+    STATUSES = [
+        ('pending', 'Pending'),
+        ('enrolled', 'Enrolled'),
+        ('reserved', 'Reserved'),
+        ('rejected', 'Rejected'),
+    ]
+
+    training = models.ForeignKey(
+        Training, on_delete=models.CASCADE, related_name='enrollment_tickets')
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    status = models.CharField(
+        max_length=10, choices=STATUSES, default='pending')
+    detail = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['training', 'user'], condition=Q(status='pending'),
+                name='ticket_one_pending_per_user'),
+        ]
+        indexes = [
+            models.Index(fields=['training', 'status', 'id'],
+                         name='ticket_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"Ticket {self.id} for training {self.training_id}: {self.status}"
+
+
+@receiver(m2m_changed, sender=Training.participants.through)
+def update_current_participants(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Поддерживает Training.current_participants при изменении состава через
+    participants.add/remove/clear и обратную сторону CustomUser.trainings.
+    """
+    if action == 'post_add':
+        # В post_add pk_set содержит только действительно добавленные строки
+        if not pk_set:
+            return
+        if reverse:
+            Training.objects.filter(pk__in=pk_set).update(
+                current_participants=F('current_participants') + 1)
+        else:
+            Training.objects.filter(pk=instance.pk).update(
+                current_participants=F('current_participants') + len(pk_set))
+
+    elif action in ('pre_remove', 'pre_clear'):
+        # pk_set при удалении не сверяется с таблицей, поэтому запоминаем
+        # существующие строки до DELETE
+        if reverse:
+            rows = sender.objects.filter(user_id=instance.pk)
+            if pk_set is not None:
+                rows = rows.filter(training_id__in=pk_set)
+        else:
+            rows = sender.objects.filter(training_id=instance.pk)
+            if pk_set is not None:
+                rows = rows.filter(user_id__in=pk_set)
+        instance._removed_participations = list(
+            rows.values_list('training_id', flat=True))
+
+    elif action in ('post_remove', 'post_clear'):
+        training_ids = instance.__dict__.pop('_removed_participations', [])
+        if not training_ids:
+            return
+        if reverse:
+            Training.objects.filter(pk__in=training_ids).update(
+                current_participants=F('current_participants') - 1)
+        else:
+            Training.objects.filter(pk=instance.pk).update(
+                current_participants=F('current_participants') - len(training_ids))
 
 
 class Subscription(models.Model):
@@ -217,132 +426,119 @@ class Subscription(models.Model):
         max_length=50, choices=CLIENT_TYPES, blank=True)  # Увеличиваем длину поля
     month = models.CharField(max_length=20, blank=True)
     is_paid = models.BooleanField(default=False)
-    confirmed = models.BooleanField(default=False)
     reserve_priority = models.IntegerField(default=0)
+    # Компактное представление days_of_week и month, пересчитывается в save():
+    # бит 0 — понедельник ... бит 6 — воскресенье, 0 — любые дни;
+    # месяцы в виде YYYYMM, пустой список — любые месяцы
+    weekday_mask = models.PositiveSmallIntegerField(default=0)
+    months = ArrayField(models.PositiveIntegerField(),
+                        default=list, blank=True)
 
     def enroll_user_to_trainings(self):
         """
         Автоматически записывает пользователя на тренировки, соответствующие абонементу.
+        Возвращает EnrollmentResult со списками записанных и пропущенных тренировок.
         """
-        logger.info(
-            f"Starting enroll_user_to_trainings for subscription {self.id}")
-
-        if not self.is_paid:
-            logger.info(
-                f"Subscription {self.id} is not paid, skipping enrollment")
-            return
-
-        logger.info(
-            f"Enrolling user {self.user.id} with level {self.user.level} and gender {self.user.gender} "
-            f"to trainings in gym {self.gym.id} from {self.start_date} to {self.end_date}"
-        )
+        from .enrollment import enroll_subscription
 
         try:
-            trainings = Training.objects.filter(
-                gym=self.gym,
-                date__gte=self.start_date,
-                date__lte=self.end_date,
-                level=self.user.level,
-            ).filter(Q(gender=self.user.gender) | Q(gender='any'))
-
-            logger.info(
-                f"Found {trainings.count()} potential trainings for subscription {self.id}")
-            if not trainings:
-                logger.info(f"No trainings found for subscription {self.id}")
-                return
-
-            for training in trainings:
-                logger.info(
-                    f"Potential training: ID {training.id}, Date {training.date}, Level {training.level}, Gender {training.gender}")
-
-            enrolled_count = 0
-            for training in trainings:
-                logger.info(f"Checking training {training.id} for enrollment")
-                if self.is_valid_for_training(training):  # Исправлено
-                    if training.current_participants < training.max_participants:
-                        if self.trainings_left > 0:
-                            logger.info(
-                                f"Enrolling user {self.user.id} to training {training.id}")
-                            training.participants.add(self.user)
-                            training.current_participants = training.participants.count()
-                            training.save()
-                            self.use_training()
-                            enrolled_count += 1
-                            logger.info(
-                                f"Successfully enrolled user {self.user.id} to training {training.id}")
-                        else:
-                            logger.info(
-                                f"No trainings left in subscription {self.id}")
-                            break
-                    else:
-                        logger.info(
-                            f"Training {training.id} is full. Current participants: {training.current_participants}, Max participants: {training.max_participants}")
-                else:
-                    logger.info(
-                        f"Training {training.id} is not valid for subscription {self.id}")
-
-            logger.info(
-                f"Enrolled user to {enrolled_count} trainings for subscription {self.id}")
-
+            return enroll_subscription(self)
         except Exception as e:
             logger.error(
                 f"Error enrolling user to trainings for subscription {self.id}: {e}")
 
     def save(self, *args, **kwargs):
-        is_new = self.pk is None
-        super().save(*args, **kwargs)
-        if is_new and self.is_paid and not self.confirmed:
-            logger.info(
-                f"New paid subscription {self.id} created, enrolling user to trainings")
-            self.enroll_user_to_trainings()
-        else:
-            logger.info(
-                f"Subscription {self.id} saved, but not enrolling user to trainings")
+        self.weekday_mask = weekday_mask_from_days(self.days_of_week)
+        self.months = month_keys_from_string(self.month)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(
+                update_fields) | {'weekday_mask', 'months'}
+        # Событие записи на тренировки (signals.py) публикуется в той же
+        # транзакции, что и сам абонемент
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
     def is_valid_for_training(self, training):
         """
         Проверяет, действителен ли абонемент для записи на данное занятие.
         """
-        logger.info(
-            f"Checking if subscription {self.id} is valid for training {training.id}")
-
         if not self.is_paid:
-            logger.info(f"Subscription {self.id} is not paid.")
+            logger.debug(f"Subscription {self.id} is not paid.")
             return False
 
-        training_day_of_week = training.date.strftime('%a').lower()[:3]
-        if self.days_of_week:
-            if training_day_of_week not in self.days_of_week.split(','):
-                logger.info(
-                    f"Training day {training_day_of_week} does not match subscription days {self.days_of_week}.")
-                return False
-        else:
-            logger.info(
-                f"No specific days set for subscription {self.id}, allowing all days.")
-
-        training_month_year = f"{training.date.year}-{training.date.month}"
-        if self.month:
-            if training_month_year not in self.month.split(','):
-                logger.info(
-                    f"Training month {training_month_year} does not match subscription month {self.month}.")
-                return False
-        else:
-            logger.info(
-                f"No specific month set for subscription {self.id}, allowing all months.")
+        # День и месяц берём в локальном времени, как и lookups в training_filter()
+        training_date = timezone.localtime(training.date)
+        if self.weekday_mask and not self.weekday_mask & (1 << training_date.weekday()):
+            logger.debug(
+                f"Training {training.id} weekday does not match subscription {self.id}.")
+            return False
+
+        if self.months and training_date.year * 100 + training_date.month not in self.months:
+            logger.debug(
+                f"Training {training.id} month does not match subscription {self.id}.")
+            return False
 
-        logger.info(
-            f"Subscription {self.id} is valid for training {training.id}")
         return True
 
+    def training_filter(self):
+        """
+        Условия дней недели и месяцев абонемента в виде Q для Training.
+        """
+        condition = Q()
+        if self.weekday_mask:
+            # date__week_day: 1 — воскресенье, 2 — понедельник, ... 7 — суббота
+            condition &= Q(date__week_day__in=[
+                (bit + 1) % 7 + 1 for bit in range(7) if self.weekday_mask & (1 << bit)
+            ])
+        if self.months:
+            months = Q()
+            for key in self.months:
+                months |= Q(date__year=key // 100, date__month=key % 100)
+            condition &= months
+        return condition
+
     def use_training(self):
         """
-        Уменьшает количество оставшихся тренировок в абонементе.
+        Уменьшает количество оставшихся тренировок в абонементе условным
+        UPDATE: параллельные списания не теряются и не уводят остаток в минус.
+        Возвращает False, если тренировок не осталось.
         """
-        if self.trainings_left > 0:
-            self.trainings_left -= 1
-            self.save()
-        else:
+        updated = Subscription.objects.filter(pk=self.pk, trainings_left__gt=0).update(
+            trainings_left=F('trainings_left') - 1)
+        if not updated:
             logger.warning(f"No trainings left in subscription {self.id}.")
+            return False
+        self.trainings_left -= 1
+        return True
+
+
+def weekday_mask_from_days(days_of_week):
+    """
+    'mon,wed,fri' -> битовая маска дней недели (бит 0 — понедельник).
+    """
+    codes = [code for code, _ in Subscription.DAYS_OF_WEEK]
+    mask = 0
+    for day in (days_of_week or '').split(','):
+        day = day.strip().lower()
+        if day in codes:
+            mask |= 1 << codes.index(day)
+    return mask
+
+
+def month_keys_from_string(month):
+    """
+    '2024-10,2024-11' -> [202410, 202411].
+    """
+    keys = []
+    for item in (month or '').split(','):
+        try:
+            year, month_number = (int(part) for part in item.strip().split('-'))
+        except ValueError:
+            continue
+        if 1 <= month_number <= 12:
+            keys.append(year * 100 + month_number)
+    return sorted(set(keys))
 
 
 class TrainingFeedback(models.Model):
@@ -354,3 +550,152 @@ class TrainingFeedback(models.Model):
 
     def __str__(self):
         return f"Feedback for {self.training} by {self.user.email}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    Сохранённый ответ на запрос с заголовком Idempotency-Key.
+    key — sha256 от пользователя, метода, пути и значения заголовка,
+    request_hash — sha256 тела запроса. Пустой status_code означает, что
+    запрос ещё выполняется; после locked_until ключ считается брошенным.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    request_hash = models.CharField(max_length=64, blank=True)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.JSONField(
+        null=True, blank=True, encoder=DjangoJSONEncoder)
+    expires_at = models.DateTimeField(db_index=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.key
+
+
+class Job(models.Model):
+    """
+    Задача фоновой очереди (см. backend.jobs). name — путь к функции,
+    помеченной @task, payload — её именованные аргументы. Воркер арендует
+    задачу до locked_until; после max_attempts неудач задача остаётся
+    в статусе failed.
+    """
+    STATUSES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    name = models.CharField(max_length=200)
+    payload = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    status = models.CharField(
+        max_length=20, choices=STATUSES, default='queued')
+    # Уникальный ключ запуска, например слот периодической задачи
+    key = models.CharField(max_length=255, null=True, blank=True, unique=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Готовые к запуску задачи и задачи с истёкшей арендой
+            models.Index(fields=['run_at'], name='job_ready_idx',
+                         condition=Q(status='queued')),
+            models.Index(fields=['locked_until'], name='job_lease_idx',
+                         condition=Q(status='running')),
+        ]
+
+    def __str__(self):
+        return f"Job {self.id} {self.name}: {self.status}"
+
+
+class OutboxEvent(models.Model):
+    """
+    Побочный эффект (письмо, запись на тренировки), записанный в той же
+    транзакции, что и вызвавшее его изменение: при откате событие исчезает
+    вместе с ним. backend.outbox.drain отправляет события пачками по темам;
+    после OUTBOX_MAX_ATTEMPTS неудач событие остаётся неотправленным для
+    разбора.
+    """
+    topic = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now)
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+    # Аренда: событие обрабатывается вне транзакции выборки
+    locked_until = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='outbox_pending_idx',
+                         condition=Q(dispatched_at__isnull=True)),
+        ]
+
+    def __str__(self):
+        return f"OutboxEvent {self.id} {self.topic}"
+
+
+class Notification(models.Model):
+    """
+    Уведомление во внутреннем почтовом ящике пользователя. Текст не
+    хранится: клиент строит его по type и payload. Счётчик непрочитанных
+    денормализован в NotificationCounter (см. backend.inbox).
+    """
+    TYPES = [
+        ('confirm_training', 'Confirm training'),
+        ('reservation_cancelled', 'Reservation cancelled'),
+        ('training_cancelled', 'Training cancelled'),
+        ('schedule_changed', 'Schedule changed'),
+        ('subscription_created', 'Subscription created'),
+    ]
+
+    user = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name='notifications')
+    type = models.CharField(max_length=50, choices=TYPES)
+    training = models.ForeignKey(
+        Training, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    payload = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    is_read = models.BooleanField(default=False)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'is_read', 'created_at'],
+                         name='notification_inbox_idx'),
+        ]
+
+    def __str__(self):
+        return f"Notification {self.id} {self.type} for {self.user_id}"
+
+
+class NotificationCounter(models.Model):
+    """
+    Число непрочитанных уведомлений пользователя. Меняется только через F()
+    вместе с созданием и прочтением уведомлений, поэтому не требует
+    подсчёта по таблице Notification.
+    """
+    user = models.OneToOneField(
+        CustomUser, on_delete=models.CASCADE, primary_key=True, related_name='notification_counter')
+    unread = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.unread} unread"
+
+
+class CrmContact(models.Model):
+    """
+    Соответствие пользователя контакту AmoCRM: уведомления обновляют
+    существующий контакт вместо создания нового (см. backend.amocrm).
+    """
+    user = models.OneToOneField(
+        CustomUser, on_delete=models.CASCADE, primary_key=True, related_name='crm_contact')
+    contact_id = models.BigIntegerField(unique=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.user_id} -> {self.contact_id}"
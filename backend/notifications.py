@@ -1,45 +1,122 @@
 # notifications.py
-from django.core.mail import send_mail
+from django.core.mail import EmailMessage
 from django.conf import settings
+import logging
 import requests
 
+from .amocrm import push_notifications
+from .mail import send_messages
+from .models import CustomUser, Training
+
+logger = logging.getLogger(__name__)
+
 
 def send_confirmation_notification(user, training):
+    send_confirmation_notifications([(user, training)])
+
+
+def send_confirmation_notifications(pairs):
+    # Письма уходят пачками через переиспользуемое соединение (backend.mail)
     subject = 'Подтвердите запись на тренировку'
-    message = f'Уважаемый {user.first_name}, подтвердите запись на тренировку {training.date}.'
-    send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, [user.email])
+    messages = [
+        f'Уважаемый {user.first_name}, подтвердите запись на тренировку {training.date}.'
+        for user, training in pairs
+    ]
+    result = send_messages([
+        EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL, [user.email])
+        for (user, training), message in zip(pairs, messages)
+    ])
 
-    # Отправка уведомления через AmoCRM
-    send_amocrm_notification(user, message)
+    send_amocrm_notifications(
+        [(user, message) for (user, training), message in zip(pairs, messages)])
+    return result
 
 
 def send_cancellation_notification(user, training):
+    send_cancellation_notifications([(user, training)])
+
+
+def send_cancellation_notifications(pairs):
     subject = 'Ваша бронь на тренировку отменена'
-    message = f'Уважаемый {user.first_name}, ваша бронь на тренировку {training.date} отменена.'
-    send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, [user.email])
+    messages = [
+        f'Уважаемый {user.first_name}, ваша бронь на тренировку {training.date} отменена.'
+        for user, training in pairs
+    ]
+    result = send_messages([
+        EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL, [user.email])
+        for (user, training), message in zip(pairs, messages)
+    ])
+
+    send_amocrm_notifications(
+        [(user, message) for (user, training), message in zip(pairs, messages)])
+    return result
+
+
+def series_update_messages(users, training):
+    subject = 'Изменения в расписании тренировок'
+    return [
+        EmailMessage(
+            subject,
+            f'Уважаемый {user.first_name}, изменились тренировки серии {training}, на которые вы записаны.',
+            settings.DEFAULT_FROM_EMAIL, [user.email])
+        for user in users
+    ]
+
+
+def send_series_update_notifications(users, training):
+    return send_messages(series_update_messages(users, training))
 
-    # Отправка уведомления через AmoCRM
-    send_amocrm_notification(user, message)
+
+def load_recipients(payloads):
+    """
+    Превращает payload событий outbox с user_id и training_id в пары
+    (пользователь, тренировка) двумя запросами. События об удалённых
+    пользователях и тренировках пропускаются. Возвращает индексы payload,
+    для которых найдены пары, и сами пары.
+    """
+    users = CustomUser.objects.in_bulk({payload['user_id'] for payload in payloads})
+    trainings = Training.objects.in_bulk({payload['training_id'] for payload in payloads})
+    indexes, pairs = [], []
+    for index, payload in enumerate(payloads):
+        if payload['user_id'] in users and payload['training_id'] in trainings:
+            indexes.append(index)
+            pairs.append((users[payload['user_id']], trainings[payload['training_id']]))
+    return indexes, pairs
+
+
+def failed_events(indexes, result):
+    # Письмо i отправлялось по событию indexes[i]
+    return {indexes[position]: error for position, error in result.failed.items()}
+
+
+def deliver_confirmation_reminders(payloads):
+    indexes, pairs = load_recipients(payloads)
+    return failed_events(indexes, send_confirmation_notifications(pairs))
+
+
+def deliver_cancellation_notices(payloads):
+    indexes, pairs = load_recipients(payloads)
+    return failed_events(indexes, send_cancellation_notifications(pairs))
+
+
+def deliver_series_updates(payloads):
+    # Одно событие на получателя: повтор не дублирует письма остальным
+    indexes, pairs = load_recipients(payloads)
+    messages = [
+        message
+        for user, training in pairs
+        for message in series_update_messages([user], training)
+    ]
+    return failed_events(indexes, send_messages(messages))
 
 
 def send_amocrm_notification(user, message):
-    url = 'https://ilya33533.amocrm.ru/api/v4/contacts'
-    headers = {
-        'Authorization': f'Bearer {settings.AMOCRM_ACCESS_TOKEN}'
-    }
-    data = {
-        'name': user.first_name,
-        'custom_fields_values': [
-            {
-                'field_id': 12345,  # ID поля для уведомления
-                'values': [
-                    {
-                        'value': message
-                    }
-                ]
-            }
-        ]
-    }
-    response = requests.post(url, headers=headers, json=data)
-    if response.status_code != 200:
-        print(f'Ошибка отправки уведомления в AmoCRM: {response.status_code}')
+    send_amocrm_notifications([(user, message)])
+
+
+def send_amocrm_notifications(pairs):
+    # Недоступность CRM не должна приводить к повторной отправке писем
+    try:
+        push_notifications(pairs)
+    except requests.RequestException as e:
+        logger.error(f'Ошибка отправки уведомлений в AmoCRM: {e}')
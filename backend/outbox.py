@@ -0,0 +1,137 @@
+import logging
+import traceback
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+# Тема события -> обработчик, принимающий список payload одной пачки
+HANDLERS = {
+    'subscription.paid': 'backend.enrollment.enroll_paid_subscriptions',
+    'reservation.remind': 'backend.notifications.deliver_confirmation_reminders',
+    'reservation.cancelled': 'backend.notifications.deliver_cancellation_notices',
+    'series.updated': 'backend.notifications.deliver_series_updates',
+}
+
+
+def publish(topic, **payload):
+    """
+    Записывает событие в outbox. Вызывается внутри транзакции изменения,
+    которое породило событие: событие появится вместе с фиксацией.
+    """
+    return publish_many(topic, [payload])[0]
+
+
+def publish_many(topic, payloads):
+    # Неизвестная тема — ошибка вызывающего кода, а не повод терять событие
+    if topic not in HANDLERS:
+        raise ValueError(f"Unknown outbox topic {topic}")
+    now = timezone.now()
+    return OutboxEvent.objects.bulk_create([
+        OutboxEvent(topic=topic, payload=payload, created_at=now)
+        for payload in payloads
+    ])
+
+
+def dispatch(topic, events):
+    """
+    Передаёт пачку событий одной темы обработчику. Обработчик возвращает
+    {индекс payload: ошибка} для событий, которые не удалось обработать,
+    или None, если обработаны все. Если обработчик упал целиком, события
+    пачки передаются ему по одному, чтобы одно плохое событие не задерживало
+    остальные. Возвращает {pk события: ошибка}.
+    """
+    try:
+        failures = import_string(HANDLERS[topic])([event.payload for event in events]) or {}
+    except Exception:
+        if len(events) == 1:
+            return {events[0].pk: traceback.format_exc()}
+        logger.warning(
+            f"Outbox topic {topic} failed for {len(events)} events, dispatching one by one")
+    else:
+        return {events[index].pk: error for index, error in failures.items()}
+    failures = {}
+    for event in events:
+        failures.update(dispatch(topic, [event]))
+    return failures
+
+
+def claim(size):
+    """
+    Забирает до size неотправленных событий в аренду до now + OUTBOX_LEASE
+    и сразу фиксирует выборку: обработчики (письма, запросы в CRM) работают
+    вне транзакции и не держат блокировки строк. Попытка засчитывается при
+    выборе, поэтому событие, на котором падает процесс, тоже исчерпает
+    OUTBOX_MAX_ATTEMPTS.
+    """
+    now = timezone.now()
+    lease = now + settings.OUTBOX_LEASE
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects.select_for_update(skip_locked=True)
+            .filter(dispatched_at__isnull=True, attempts__lt=settings.OUTBOX_MAX_ATTEMPTS)
+            .filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now))
+            .order_by('created_at')[:size]
+        )
+        OutboxEvent.objects.filter(pk__in=[event.pk for event in events]).update(
+            locked_until=lease, attempts=F('attempts') + 1)
+    for event in events:
+        event.locked_until = lease
+        event.attempts += 1
+    return events
+
+
+def drain(batch_size=500, limit=None):
+    """
+    Отправляет накопившиеся события пачками: выборка по частичному индексу
+    неотправленных, группировка по темам, один вызов обработчика на тему
+    и одно обновление отправленных. Параллельные запуски делят очередь
+    через SKIP LOCKED и аренду locked_until. Доставка «хотя бы один раз»:
+    если отметка dispatched_at не зафиксировалась, событие будет отправлено
+    повторно после истечения аренды. limit ограничивает число событий за
+    запуск, остальные ждут следующего. Возвращает число отправленных событий.
+    """
+    dispatched = 0
+    claimed = 0
+    while limit is None or claimed < limit:
+        size = batch_size if limit is None else min(batch_size, limit - claimed)
+        events = claim(size)
+        by_topic = defaultdict(list)
+        for event in events:
+            by_topic[event.topic].append(event)
+
+        failures = {}
+        for topic, group in by_topic.items():
+            failures.update(dispatch(topic, group))
+
+        done = [event.pk for event in events if event.pk not in failures]
+        OutboxEvent.objects.filter(pk__in=done).update(
+            dispatched_at=timezone.now(), locked_until=None)
+        for event in events:
+            if event.pk not in failures:
+                continue
+            logger.error(
+                f"Outbox event {event.pk} {event.topic} failed, attempt {event.attempts}: {failures[event.pk]}")
+            if event.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+                logger.error(
+                    f"Outbox event {event.pk} {event.topic} exhausted {event.attempts} attempts, giving up")
+            # Аренду снимаем, только если событие не перехватил другой запуск
+            OutboxEvent.objects.filter(pk=event.pk, locked_until=event.locked_until).update(
+                last_error=failures[event.pk], locked_until=None)
+
+        dispatched += len(done)
+        claimed += len(events)
+        # Упавшие события повторяются при следующем запуске, а не в этом цикле
+        if len(events) < size or failures:
+            break
+
+    if dispatched:
+        logger.info(f"Dispatched {dispatched} outbox events")
+    return dispatched
@@ -0,0 +1,23 @@
+from rest_framework.pagination import CursorPagination
+
+
+class TrainingCursorPagination(CursorPagination):
+    """
+    Курсорная пагинация ленты тренировок по (date, id): глубина выдачи
+    не влияет на стоимость запроса, а размер ответа ограничен page_size.
+    """
+    ordering = ('date', 'id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class NotificationCursorPagination(CursorPagination):
+    """
+    Курсорная пагинация почтового ящика от новых к старым: страница
+    читается по индексу (user, is_read, created_at) без подсчёта строк.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = 30
+    page_size_query_param = 'page_size'
+    max_page_size = 100
@@ -0,0 +1,437 @@
+import datetime
+import logging
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .enrollment import auto_enroll_trainings, promote_waitlist, schedule_confirmations
+from .models import Training
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
+FREQUENCIES = ('DAILY', 'WEEKLY')
+SCOPES = ('following', 'all')
+
+# Поля, которые повторения наследуют от родительской тренировки серии
+SERIES_FIELDS = ('gym_id', 'trainer_id', 'level', 'max_participants', 'intensity', 'gender',
+                 'queued_enrollment', 'recurrence_end_date')
+
+
+class RecurrenceRule:
+    """
+    Подмножество RRULE (RFC 5545): FREQ=DAILY|WEEKLY, INTERVAL, BYDAY, UNTIL, COUNT.
+    Пример: FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,TH;UNTIL=20261231
+    """
+
+    def __init__(self, freq='WEEKLY', interval=1, byday=(), until=None, count=None):
+        self.freq = freq
+        self.interval = interval
+        self.byday = sorted(set(byday))
+        self.until = until
+        self.count = count
+
+    @classmethod
+    def parse(cls, text):
+        parts = {}
+        for item in text.strip().upper().split(';'):
+            if not item:
+                continue
+            name, sep, value = item.partition('=')
+            if not sep or not value:
+                raise ValueError(f"Malformed rule part '{item}'")
+            parts[name] = value
+
+        freq = parts.pop('FREQ', 'WEEKLY')
+        if freq not in FREQUENCIES:
+            raise ValueError(f"Unsupported FREQ '{freq}'")
+        try:
+            interval = int(parts.pop('INTERVAL', 1))
+            count = int(parts.pop('COUNT')) if 'COUNT' in parts else None
+            until = (datetime.datetime.strptime(parts.pop('UNTIL')[:8], '%Y%m%d').date()
+                     if 'UNTIL' in parts else None)
+            byday = [WEEKDAYS.index(day) for day in parts.pop('BYDAY').split(',')] if 'BYDAY' in parts else []
+        except ValueError:
+            raise ValueError('Malformed INTERVAL, COUNT, UNTIL or BYDAY')
+        if parts:
+            raise ValueError(f"Unsupported rule parts: {', '.join(sorted(parts))}")
+        if interval < 1 or (count is not None and count < 1):
+            raise ValueError('INTERVAL and COUNT must be positive')
+        return cls(freq, interval, byday, until, count)
+
+    def __str__(self):
+        parts = [f"FREQ={self.freq}"]
+        if self.interval != 1:
+            parts.append(f"INTERVAL={self.interval}")
+        if self.byday:
+            parts.append(f"BYDAY={','.join(WEEKDAYS[day] for day in self.byday)}")
+        if self.until:
+            parts.append(f"UNTIL={self.until:%Y%m%d}")
+        if self.count is not None:
+            parts.append(f"COUNT={self.count}")
+        return ';'.join(parts)
+
+    @property
+    def is_bounded(self):
+        return self.until is not None or self.count is not None
+
+    def dates(self, start, exdates=(), until=None):
+        """
+        Даты повторений, начиная с start включительно, в порядке возрастания.
+        until дополнительно ограничивает серию; без UNTIL, COUNT и until
+        генератор бесконечен. exdates исключаются из выдачи, но, как и в
+        RFC 5545, учитываются в COUNT.
+        """
+        exdates = set(exdates)
+        for day in self.candidates(start, until):
+            if day not in exdates:
+                yield day
+
+    def candidates(self, start, until=None):
+        """
+        Все дни правила с start включительно, в том числе исключённые:
+        именно они расходуют COUNT. Сам start входит всегда.
+        """
+        limits = [value for value in (self.until, until) if value]
+        last = min(limits) if limits else None
+        produced = 0
+
+        if self.freq == 'DAILY':
+            step, weekdays = datetime.timedelta(days=self.interval), None
+            period_start = start
+        else:
+            step = datetime.timedelta(weeks=self.interval)
+            weekdays = self.byday or [start.weekday()]
+            period_start = start - datetime.timedelta(days=start.weekday())
+            if start.weekday() not in weekdays:
+                # Как в RFC 5545: start (DTSTART) — первое повторение серии
+                # и расходует COUNT, даже если его дня недели нет в BYDAY
+                if last and start > last:
+                    return
+                produced += 1
+                yield start
+
+        while True:
+            candidates = ([period_start] if weekdays is None else
+                          [period_start + datetime.timedelta(days=day) for day in weekdays])
+            for day in candidates:
+                if day < start:
+                    continue
+                if last and day > last:
+                    return
+                if self.count is not None and produced >= self.count:
+                    return
+                produced += 1
+                yield day
+            period_start += step
+
+    def count_before(self, start, day):
+        # Сколько COUNT израсходовано до дня day, включая исключённые дни
+        return sum(1 for _ in self.candidates(start, until=day - datetime.timedelta(days=1)))
+
+
+def rule_for_training(training):
+    """
+    Правило повторения серии: recurrence_rule или, для старых серий,
+    еженедельно до recurrence_end_date. None, если тренировка не повторяется.
+    """
+    if not training.is_recurring:
+        return None
+    if training.recurrence_rule:
+        return RecurrenceRule.parse(training.recurrence_rule)
+    if training.recurrence_end_date:
+        return RecurrenceRule(until=training.recurrence_end_date)
+    return None
+
+
+def occurrence_datetime(series, day):
+    """
+    Время занятия серии в день day (в локальном времени родительской тренировки).
+    """
+    local_start = timezone.localtime(series.date)
+    return timezone.make_aware(datetime.datetime.combine(day, local_start.time().replace(tzinfo=None)))
+
+
+def occurrence_fields(series, day):
+    """
+    Значения полей повторения серии на день day.
+    """
+    date = occurrence_datetime(series, day)
+    fields = {field: getattr(series, field) for field in SERIES_FIELDS}
+    fields.update(date=date, occurrence_date=day,
+                  is_recurring=True, parent_training=series)
+    if series.unenroll_deadline:
+        fields['unenroll_deadline'] = series.unenroll_deadline + (date - series.date)
+    return fields
+
+
+def build_occurrence(series, day):
+    """
+    Несохранённое повторение серии на день day. Уже загруженные зал и тренер
+    серии переиспользуются, чтобы сериализация не делала лишних запросов.
+    """
+    occurrence = Training(**occurrence_fields(series, day))
+    for name in ('gym', 'trainer'):
+        field = Training._meta.get_field(name)
+        if field.is_cached(series):
+            field.set_cached_value(occurrence, field.get_cached_value(series))
+    return occurrence
+
+
+def series_dates(series, after=None, until=None):
+    """
+    Даты повторений серии после её первой тренировки (и после after, если задан).
+    """
+    rule = rule_for_training(series)
+    if rule is None:
+        return
+    first_day = timezone.localtime(series.date).date()
+    bound = min(value for value in (until, series.recurrence_end_date) if value) \
+        if (until or series.recurrence_end_date) else None
+    if bound is None and not rule.is_bounded:
+        raise ValueError(f"Series {series.pk} has no end; pass until")
+    for day in rule.dates(first_day, series.recurrence_exdates, bound):
+        if day == first_day or (after and day <= after):
+            continue
+        yield day
+
+
+def materialize_series(series, after=None, until=None):
+    """
+    Создаёт недостающие повторения серии одним bulk_create. Уже существующие
+    дни (одна выборка по parent_training) пропускаются, поэтому вызов
+    идемпотентен. Возвращает созданные тренировки; запись абонементов на них
+    (enrollment.auto_enroll_trainings) — забота вызывающего кода.
+    """
+    existing = set(Training.objects.filter(
+        parent_training=series).values_list('occurrence_date', flat=True))
+    occurrences = []
+    for day in series_dates(series, after, until):
+        if day not in existing:
+            occurrences.append(build_occurrence(series, day))
+
+    created = Training.objects.bulk_create(occurrences)
+    if created:
+        logger.info(
+            f"Materialized {len(created)} occurrences of series {series.pk}")
+    return created
+
+
+def generate_schedule(until, dry_run=False, batch_size=500):
+    """
+    Досоздаёт повторения всех неленивых серий до даты until включительно.
+    Серии разворачиваются в памяти, уже существующие повторения находятся
+    одной выборкой по (parent_training, occurrence_date), недостающие
+    вставляются bulk_create. Серии блокируются на время прохода, так что
+    параллельный запуск просто дождётся первого. Возвращает список
+    повторений (сохранённых, если не dry_run), добавленных этим запуском.
+    """
+    today = timezone.localdate()
+    with transaction.atomic():
+        series_list = list(
+            Training.objects.select_for_update(of=('self',))
+            .select_related('gym', 'trainer')
+            .filter(
+                Q(recurrence_end_date__isnull=True) | Q(
+                    recurrence_end_date__gt=today),
+                is_recurring=True,
+                lazy_occurrences=False,
+                parent_training__isnull=True,
+            )
+            .order_by('pk')
+        )
+        existing = set(Training.objects.filter(
+            parent_training__in=[series.pk for series in series_list],
+            occurrence_date__gt=today,
+            occurrence_date__lte=until,
+        ).values_list('parent_training_id', 'occurrence_date'))
+
+        missing = []
+        for series in series_list:
+            for day in series_dates(series, after=today, until=until):
+                if (series.pk, day) not in existing:
+                    missing.append(build_occurrence(series, day))
+
+        if dry_run or not missing:
+            return missing
+        created = Training.objects.bulk_create(missing, batch_size=batch_size)
+        auto_enroll_trainings(created)
+
+    logger.info(
+        f"Schedule generated up to {until}: {len(created)} occurrences in {len(series_list)} series")
+    return created
+
+
+def is_occurrence(series, day):
+    """
+    Входит ли день day в серию (с учётом исключённых дней).
+    """
+    previous = day - datetime.timedelta(days=1)
+    return any(True for _ in series_dates(series, after=previous, until=day))
+
+
+def materialize_occurrence(series, day):
+    """
+    Сохраняет повторение ленивой серии на день day, если его ещё нет.
+    Возвращает (training, created); гонку двух запросов разрешает
+    уникальность (parent_training, occurrence_date).
+    """
+    if day == timezone.localtime(series.date).date():
+        return series, False
+    if not is_occurrence(series, day):
+        raise ValueError(f"{day} is not an occurrence of series {series.pk}")
+    if not series.lazy_occurrences and is_deleted_occurrence(series, day):
+        raise ValueError(f"Occurrence {day} of series {series.pk} was deleted")
+    fields = occurrence_fields(series, day)
+    return Training.objects.get_or_create(
+        parent_training=fields.pop('parent_training'),
+        occurrence_date=fields.pop('occurrence_date'),
+        defaults=fields,
+    )
+
+
+def is_deleted_occurrence(series, day):
+    """
+    Удалено ли повторение неленивой серии на день day: его нет, хотя
+    генератор уже создал повторения после него. Покрывает удаления,
+    сделанные до того, как удаление стало записываться в exdates.
+    """
+    children = Training.objects.filter(parent_training=series)
+    return (not children.filter(occurrence_date=day).exists()
+            and children.filter(occurrence_date__gt=day).exists())
+
+
+def exclude_day(series_id, day):
+    """
+    Добавляет day в exdates серии, чтобы генератор и материализация не
+    создали повторение на этот день заново.
+    """
+    with transaction.atomic():
+        series = Training.objects.select_for_update().get(pk=series_id)
+        series.recurrence_exdates = sorted(set(series.recurrence_exdates) | {day})
+        series.save(update_fields=['recurrence_exdates'])
+    return series
+
+
+def cancel_occurrence(series, day):
+    """
+    Исключает день day из серии. Сохранённое повторение на этот день не
+    трогаем: его отменяют как обычную тренировку.
+    """
+    if not is_occurrence(series, day):
+        raise ValueError(f"{day} is not an occurrence of series {series.pk}")
+    return exclude_day(series.pk, day)
+
+
+def virtual_occurrences(series_list, start, end, materialized=()):
+    """
+    Несохранённые повторения ленивых серий в окне [start, end] (даты).
+    materialized — пары (parent_training_id, occurrence_date) уже
+    сохранённых повторений, которые заменяют виртуальные.
+    """
+    materialized = set(materialized)
+    occurrences = []
+    for series in series_list:
+        for day in series_dates(series, after=start - datetime.timedelta(days=1), until=end):
+            if (series.pk, day) not in materialized:
+                occurrences.append(build_occurrence(series, day))
+    return occurrences
+
+
+def split_series(series, day):
+    """
+    Делит серию: повторение на день day становится головой новой серии с тем
+    же правилом, следующие повторения переходят к ней, старая серия
+    заканчивается накануне. Возвращает голову новой серии.
+    """
+    with transaction.atomic():
+        series = Training.objects.select_for_update().get(pk=series.pk)
+
+        head_rule = series.recurrence_rule
+        rule = rule_for_training(series)
+        if series.recurrence_rule and rule.count is not None:
+            # COUNT продолжает считаться от начала старой серии, исключённые
+            # дни тоже его расходуют
+            rule.count -= rule.count_before(timezone.localtime(series.date).date(), day)
+            if rule.count <= 0:
+                raise ValueError(f"{day} is past the end of series {series.pk}")
+            head_rule = str(rule)
+
+        head, _ = materialize_occurrence(series, day)
+
+        Training.objects.filter(pk=head.pk).update(
+            parent_training=None,
+            occurrence_date=None,
+            is_exception=False,
+            is_recurring=True,
+            lazy_occurrences=series.lazy_occurrences,
+            recurrence_rule=head_rule,
+            recurrence_end_date=series.recurrence_end_date,
+            recurrence_exdates=[value for value in series.recurrence_exdates if value > day],
+        )
+        Training.objects.filter(
+            parent_training=series, occurrence_date__gt=day).update(parent_training=head)
+
+        series.recurrence_end_date = day - datetime.timedelta(days=1)
+        series.recurrence_exdates = [value for value in series.recurrence_exdates if value < day]
+        series.save(update_fields=['recurrence_end_date', 'recurrence_exdates'])
+
+    head.refresh_from_db()
+    logger.info(f"Series {series.pk} split at {day}, new series {head.pk}")
+    return head
+
+
+class SeriesCapacityError(ValueError):
+    """
+    Новый max_participants серии меньше числа уже записанных на некоторые
+    тренировки; training_ids — id этих тренировок.
+    """
+
+    def __init__(self, training_ids):
+        super().__init__(f"Trainings {training_ids} have more participants than the new limit")
+        self.training_ids = training_ids
+
+
+def update_series(series, changes, scope='all', day=None, time=None):
+    """
+    Применяет изменения ко всей серии (scope='all') или к повторениям с дня
+    day (scope='following', серия при этом делится) одним UPDATE. Повторения,
+    отредактированные по отдельности (is_exception), и прошедшие тренировки
+    не трогаем. time — новое локальное время начала. Если новый
+    max_participants меньше числа записанных хотя бы на одну тренировку,
+    ничего не меняется и выбрасывается SeriesCapacityError. Возвращает id
+    изменённых тренировок.
+    """
+    first_day = timezone.localtime(series.date).date()
+    with transaction.atomic():
+        if scope == 'following' and day and day != first_day:
+            series = split_series(series, day)
+
+        rows = Training.objects.filter(
+            Q(pk=series.pk) | Q(parent_training=series, is_exception=False, date__gte=timezone.now()))
+        training_ids = list(rows.select_for_update().values_list('pk', flat=True))
+        if 'max_participants' in changes:
+            # Иначе тренировка окажется переполненной
+            overfull = sorted(Training.objects.filter(
+                pk__in=training_ids, current_participants__gt=changes['max_participants'],
+            ).values_list('pk', flat=True))
+            if overfull:
+                raise SeriesCapacityError(overfull)
+
+        updates = dict(changes)
+        if time is not None:
+            local_start = timezone.localtime(series.date)
+            delta = timezone.make_aware(datetime.datetime.combine(local_start.date(), time)) - series.date
+            updates.update(date=F('date') + delta,
+                           unenroll_deadline=F('unenroll_deadline') + delta)
+        Training.objects.filter(pk__in=training_ids).update(**updates)
+        if time is not None:
+            schedule_confirmations(training_ids, reset=True)
+
+        if 'max_participants' in changes:
+            promote_waitlist(training_ids)
+
+    logger.info(
+        f"Series {series.pk} updated ({scope}): {len(training_ids)} trainings")
+    return training_ids
@@ -2,7 +2,8 @@ from rest_framework import serializers
 from django.contrib.auth.models import User
 from rest_framework.authtoken.models import Token
 from django.contrib.auth import authenticate
-from .models import CustomUser, Profile, Gym, Training, Subscription, TrainingFeedback, Trainer
+from .models import CustomUser, Profile, Gym, Training, Subscription, TrainingFeedback, Trainer, EnrollmentTicket, Notification, month_keys_from_string
+from .recurrence import SCOPES, RecurrenceRule
 
 
 from rest_framework import serializers
@@ -226,13 +227,162 @@ class TrainingSerializer(serializers.ModelSerializer):
     class Meta:
         model = Training
         fields = ['id', 'date', 'level', 'max_participants', 'current_participants', 'trainer', 'gym', 'trainer_id',
-                  'gym_id', 'is_recurring', 'recurrence_end_date', 'unenroll_deadline', 'gender', 'participants']
+                  'gym_id', 'is_recurring', 'recurrence_end_date', 'recurrence_rule', 'recurrence_exdates',
+                  'lazy_occurrences', 'occurrence_date', 'is_exception', 'unenroll_deadline', 'gender',
+                  'participants', 'queued_enrollment']
+        read_only_fields = ['current_participants', 'occurrence_date', 'is_exception']
+
+    def validate_recurrence_rule(self, value):
+        if not value:
+            return value
+        try:
+            return str(RecurrenceRule.parse(value))
+        except ValueError as e:
+            raise serializers.ValidationError(
+                f"Некорректное правило повторения: {e}")
+
+    def validate(self, data):
+        # Границы задаются у головы серии, повторения их не несут
+        if self.instance is not None and self.instance.parent_training_id:
+            return data
+        is_recurring = data.get('is_recurring', getattr(self.instance, 'is_recurring', False))
+        rule = data.get('recurrence_rule', getattr(self.instance, 'recurrence_rule', ''))
+        end_date = data.get('recurrence_end_date', getattr(self.instance, 'recurrence_end_date', None))
+        lazy = data.get('lazy_occurrences', getattr(self.instance, 'lazy_occurrences', False))
+        # Ленивую серию можно не ограничивать: повторения разворачиваются только в окне запроса
+        if is_recurring and not lazy and not end_date and (not rule or not RecurrenceRule.parse(rule).is_bounded):
+            raise serializers.ValidationError(
+                "Для повторяющейся тренировки укажите recurrence_end_date или UNTIL/COUNT в правиле повторения")
+        return data
 
     def create(self, validated_data):
         validated_data.pop('id', None)
         return Training.objects.create(**validated_data)
 
 
+class TrainingListSerializer(serializers.ModelSerializer):
+    """
+    Компактное представление тренировки для списков: без состава участников,
+    зал и тренер отдаются только id и названием.
+    """
+    gym_id = serializers.IntegerField(read_only=True)
+    gym_name = serializers.CharField(source='gym.name', read_only=True)
+    trainer_id = serializers.IntegerField(read_only=True)
+    trainer_name = serializers.CharField(
+        source='trainer.user.get_full_name', read_only=True)
+    is_enrolled = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Training
+        fields = ['id', 'date', 'level', 'gender', 'max_participants', 'current_participants', 'gym_id', 'gym_name',
+                  'trainer_id', 'trainer_name', 'is_recurring', 'unenroll_deadline', 'is_enrolled']
+        read_only_fields = fields
+
+    def get_is_enrolled(self, obj):
+        # Значение аннотирует TrainingListView.get_queryset
+        return getattr(obj, 'is_enrolled', False)
+
+
+class ScheduleItemSerializer(TrainingListSerializer):
+    """
+    Элемент расписания: сохранённая тренировка или виртуальное повторение
+    ленивой серии (id = null, записаться можно после materialize по
+    trainings/<series_id>/occurrences/<occurrence_date>/).
+    """
+    series_id = serializers.IntegerField(source='parent_training_id', read_only=True)
+    is_virtual = serializers.SerializerMethodField()
+
+    class Meta(TrainingListSerializer.Meta):
+        fields = TrainingListSerializer.Meta.fields + ['series_id', 'occurrence_date', 'is_virtual']
+        read_only_fields = fields
+
+    def get_is_virtual(self, obj):
+        return obj.pk is None
+
+
+class SeriesUpdateSerializer(serializers.Serializer):
+    """
+    Правка серии тренировок: scope='all' — вся серия, 'following' — это
+    повторение и следующие. time — новое время начала (ЧЧ:ММ).
+    """
+    scope = serializers.ChoiceField(choices=SCOPES)
+    time = serializers.TimeField(required=False)
+    level = serializers.IntegerField(required=False)
+    max_participants = serializers.IntegerField(required=False, min_value=1)
+    intensity = serializers.IntegerField(required=False, allow_null=True)
+    gender = serializers.ChoiceField(
+        choices=Training.GENDER_CHOICES, required=False)
+    gym_id = serializers.PrimaryKeyRelatedField(
+        queryset=Gym.objects.all(), required=False)
+    trainer_id = serializers.PrimaryKeyRelatedField(
+        queryset=Trainer.objects.all(), required=False)
+
+    def validate(self, data):
+        if len(data) == 1:
+            raise serializers.ValidationError("Не указано, что изменить в серии")
+        return data
+
+    def get_changes(self):
+        changes = {name: value for name, value in self.validated_data.items()
+                   if name not in ('scope', 'time')}
+        for name in ('gym_id', 'trainer_id'):
+            if name in changes:
+                changes[name] = changes[name].pk
+        return changes
+
+
+class RosterMemberSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CustomUser
+        fields = ['id', 'first_name', 'last_name', 'email']
+
+
+class RosterOperationSerializer(serializers.Serializer):
+    OPERATIONS = [
+        ('add', 'Add'),
+        ('remove', 'Remove'),
+        ('reserve', 'Move to reserve'),
+    ]
+
+    op = serializers.ChoiceField(choices=OPERATIONS)
+    user_id = serializers.IntegerField()
+
+
+class RosterUpdateSerializer(serializers.Serializer):
+    operations = RosterOperationSerializer(many=True, allow_empty=False)
+
+    def validate_operations(self, value):
+        user_ids = {operation['user_id'] for operation in value}
+        existing = set(CustomUser.objects.filter(
+            pk__in=user_ids).values_list('pk', flat=True))
+        missing = user_ids - existing
+        if missing:
+            raise serializers.ValidationError(
+                f"Users not found: {', '.join(map(str, sorted(missing)))}")
+        return value
+
+
+class EnrollmentTicketSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = EnrollmentTicket
+        fields = ['id', 'training', 'status', 'detail',
+                  'created_at', 'processed_at']
+        read_only_fields = fields
+
+
+class NotificationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Notification
+        fields = ['id', 'type', 'training', 'payload', 'is_read', 'created_at']
+        read_only_fields = fields
+
+
+class NotificationReadSerializer(serializers.Serializer):
+    # Без ids прочитанными отмечаются все уведомления
+    ids = serializers.ListField(
+        child=serializers.IntegerField(), required=False, max_length=500)
+
+
 class SubscriptionSerializer(serializers.ModelSerializer):
     days_of_week = serializers.CharField(required=False)
 
@@ -250,6 +400,12 @@ class SubscriptionSerializer(serializers.ModelSerializer):
                     f"{day} is not a valid choice.")
         return value
 
+    def validate_month(self, value):
+        if value and len(month_keys_from_string(value)) != len(set(value.split(','))):
+            raise serializers.ValidationError(
+                "Months must be given as YYYY-M separated by commas.")
+        return value
+
 
 class TrainingFeedbackSerializer(serializers.ModelSerializer):
     class Meta:
@@ -1,4 +1,5 @@
 from pathlib import Path
+from datetime import timedelta
 import os
 from corsheaders.defaults import default_headers
 from corsheaders.defaults import default_methods
@@ -44,6 +45,7 @@ INSTALLED_APPS = [
     'rest_framework',
     'rest_framework.authtoken',
     'corsheaders',
+    'django_filters',
     'backend',
     'sslserver'
 ]
@@ -108,7 +110,68 @@ CORS_ALLOW_ALL_ORIGINS = True
 
 CORS_ALLOW_CREDENTIALS = True
 CORS_ALLOW_METHODS = list(default_methods)
-CORS_ALLOW_HEADERS = list(default_headers) + ['X-CSRFToken']
+CORS_ALLOW_HEADERS = list(default_headers) + ['X-CSRFToken', 'Idempotency-Key']
+
+# Сколько хранится ответ на запрос с заголовком Idempotency-Key
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+# Сколько ключ остаётся за выполняющимся запросом; если процесс упал,
+# не сохранив ответ, после этого срока повтор выполнит запрос заново
+IDEMPOTENCY_KEY_LEASE = timedelta(minutes=1)
+
+# Максимальная длина окна (в днях) для расписания с ленивыми сериями
+SCHEDULE_MAX_DAYS = 62
+
+# На сколько недель вперёд generate_schedule создаёт повторения серий
+SCHEDULE_HORIZON_WEEKS = 8
+
+# Очередь фоновых задач (backend.jobs, manage.py run_jobs)
+JOB_LEASE = timedelta(minutes=10)
+JOB_RETRY_BACKOFF = timedelta(seconds=30)
+JOB_RETRY_BACKOFF_MAX = timedelta(hours=1)
+JOB_RETENTION = timedelta(days=7)
+# Периодические задачи: путь к функции -> интервал запуска
+JOB_SCHEDULE = {
+    'backend.tasks.send_confirmation_reminders': timedelta(minutes=5),
+    'backend.tasks.cancel_unconfirmed_reservations': timedelta(minutes=5),
+    'backend.tasks.generate_recurring_schedule': timedelta(hours=1),
+    'backend.tasks.purge_idempotency_keys': timedelta(hours=1),
+    'backend.tasks.purge_finished_jobs': timedelta(days=1),
+    'backend.tasks.drain_outbox': timedelta(seconds=15),
+    'backend.tasks.purge_dispatched_events': timedelta(days=1),
+}
+
+# Outbox побочных эффектов (backend.outbox): число попыток отправки события
+# и срок хранения отправленных
+OUTBOX_MAX_ATTEMPTS = 10
+# Сколько событие остаётся за запуском drain, который его взял; после
+# падения процесса событие подхватит следующий запуск
+OUTBOX_LEASE = timedelta(minutes=5)
+OUTBOX_RETENTION = timedelta(days=7)
+# Не больше стольких событий outbox (в основном писем) за один запуск
+# drain_outbox: ограничивает нагрузку на почтовый сервер
+OUTBOX_MAX_PER_RUN = 2000
+
+# Отправка писем (backend.mail): писем на одно SMTP-соединение, повторы
+# при временных ошибках и начальная задержка между ними в секундах
+MAIL_CHUNK_SIZE = 100
+MAIL_RETRIES = 3
+MAIL_RETRY_BACKOFF = 2.0
+
+# AmoCRM (backend.amocrm). Лимит API — 7 запросов в секунду на интеграцию
+# и до 250 сущностей в одном запросе
+AMOCRM_BASE_URL = os.getenv('AMOCRM_BASE_URL', 'https://ilya33533.amocrm.ru')
+AMOCRM_CLIENT_ID = os.getenv('AMOCRM_CLIENT_ID', '11593038')
+AMOCRM_CLIENT_SECRET = os.getenv('AMOCRM_CLIENT_SECRET', '')
+AMOCRM_REDIRECT_URI = os.getenv(
+    'AMOCRM_REDIRECT_URI', 'http://45.8.229.240:8000/oauth/callback/')
+AMOCRM_ACCESS_TOKEN = os.getenv('AMOCRM_ACCESS_TOKEN', '')
+# Поле контакта, в которое пишется текст уведомления
+AMOCRM_NOTIFICATION_FIELD_ID = int(os.getenv('AMOCRM_NOTIFICATION_FIELD_ID', '12345'))
+AMOCRM_RATE_LIMIT = 7
+AMOCRM_BATCH_SIZE = 250
+AMOCRM_POOL_SIZE = 10
+# Таймауты (соединение, чтение) в секундах
+AMOCRM_TIMEOUT = (3.05, 10)
 
 
 CSRF_COOKIE_SAMESITE = 'Lax'  # or 'None' if you're using 'Strict' CORS
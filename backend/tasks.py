@@ -1,32 +1,79 @@
 # tasks.py
-from celery import shared_task
+from django.db import transaction
 from django.utils import timezone
-from .models import Training, Subscription
-from .notifications import send_confirmation_notification, send_cancellation_notification
+from django.conf import settings
+from .enrollment import cancel_expired_reservations
+from .inbox import create_notifications
+from .jobs import task
+from .outbox import drain, publish_many
+from .recurrence import generate_schedule
+from .models import IdempotencyKey, Job, Notification, OutboxEvent, Reservation
 
 
-@shared_task
-def send_confirmation_reminders():
+@task
+def send_confirmation_reminders(batch_size=500):
+    """
+    Берёт из очереди записи с наступившим remind_at (частичный индекс по
+    необработанным), помечает их reminded_at одним UPDATE и в той же
+    транзакции публикует напоминания в outbox и в почтовый ящик.
+    Параллельные запуски делят очередь через SKIP LOCKED.
+    """
     now = timezone.now()
-    for training in Training.objects.filter(date__gt=now):
-        deadline = training.date - timezone.timedelta(days=2, hours=12)
-        if now >= deadline:
-            for user in training.participants.all():
-                subscription = Subscription.objects.filter(
-                    user=user, is_paid=True).first()
-                if subscription and not subscription.confirmed:
-                    send_confirmation_notification(user, training)
+    while True:
+        with transaction.atomic():
+            due = list(
+                Reservation.objects.select_for_update(skip_locked=True, of=('self',))
+                .filter(status='pending', reminded_at__isnull=True, remind_at__lte=now, training__date__gt=now)
+                .only('pk', 'user_id', 'training_id', 'expire_at')
+                .order_by('remind_at')[:batch_size]
+            )
+            Reservation.objects.filter(
+                pk__in=[reservation.pk for reservation in due]).update(reminded_at=now)
+            create_notifications([
+                Notification(user_id=reservation.user_id, type='confirm_training',
+                             training_id=reservation.training_id,
+                             payload={'expire_at': reservation.expire_at})
+                for reservation in due
+            ])
+            publish_many('reservation.remind', [
+                {'user_id': reservation.user_id, 'training_id': reservation.training_id}
+                for reservation in due
+            ])
 
+        if len(due) < batch_size:
+            break
 
-@shared_task
+
+@task
 def cancel_unconfirmed_reservations():
-    now = timezone.now()
-    for training in Training.objects.filter(date__gt=now):
-        deadline = training.date - timezone.timedelta(days=2, hours=15)
-        if now >= deadline:
-            for user in training.participants.all():
-                subscription = Subscription.objects.filter(
-                    user=user, is_paid=True).first()
-                if subscription and not subscription.confirmed:
-                    training.participants.remove(user)
-                    send_cancellation_notification(user, training)
+    # Уведомления о снятии публикуются в outbox в той же транзакции
+    cancel_expired_reservations()
+
+
+@task
+def drain_outbox():
+    drain(limit=settings.OUTBOX_MAX_PER_RUN)
+
+
+@task
+def purge_idempotency_keys():
+    IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+
+
+@task
+def generate_recurring_schedule():
+    generate_schedule(timezone.localdate() + timezone.timedelta(weeks=settings.SCHEDULE_HORIZON_WEEKS))
+
+
+@task
+def purge_finished_jobs():
+    # Упавшие задачи (failed) остаются для разбора
+    Job.objects.filter(
+        status='done', finished_at__lte=timezone.now() - settings.JOB_RETENTION).delete()
+
+
+@task
+def purge_dispatched_events():
+    # Неотправленные события остаются для разбора
+    OutboxEvent.objects.filter(
+        dispatched_at__lte=timezone.now() - settings.OUTBOX_RETENTION).delete()
@@ -0,0 +1,879 @@
+import datetime
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import requests
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection
+from django.db.models import Q
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework.views import APIView
+
+from .amocrm import AmoCRMClient, push_notifications
+from .enrollment import (
+    SubscriptionSlot, TrainingSlot, allocate_seats, auto_enroll_trainings, cancel_expired_reservations,
+    enroll_subscription, process_enrollment_tickets, take_seat,
+)
+from .idempotency import idempotent
+from .jobs import claim_jobs, enqueue, run_job
+from .mail import send_messages
+from .management.commands.bench_mail import SMTPHandler, SMTPServer
+from .outbox import claim, drain, publish_many
+from .models import CrmContact, CustomUser, EnrollmentTicket, Gym, IdempotencyKey, Job, OutboxEvent, Reservation, Subscription, Trainer, Training, WaitlistEntry
+from .recurrence import RecurrenceRule, SeriesCapacityError, materialize_series, series_dates, split_series, update_series
+
+
+def create_training(max_participants=10, days=1):
+    gym = Gym.objects.first() or Gym.objects.create(
+        name='Зал', metro_station='Метро', district='Район', description='')
+    trainer = Trainer.objects.first() or Trainer.objects.create(
+        user=CustomUser.objects.create_user('trainer@example.com', 'password', role='trainer'))
+    return Training.objects.create(
+        gym=gym, trainer=trainer, date=timezone.now() + datetime.timedelta(days=days),
+        level=1, max_participants=max_participants)
+
+
+def create_subscription(user, training, trainings_left=5, **fields):
+    day = timezone.localdate(training.date)
+    return Subscription.objects.create(
+        user=user, gym=training.gym, trainer=training.trainer, type='Абонемент',
+        start_date=day - datetime.timedelta(days=30), end_date=day + datetime.timedelta(days=30),
+        trainings_left=trainings_left, price=1000, is_paid=True, **fields)
+
+
+class TakeSeatConcurrencyTest(TransactionTestCase):
+    """
+    take_seat из нескольких потоков, у каждого своё соединение с базой:
+    мест занимается не больше max_participants.
+    """
+    threads = 20
+
+    def test_parallel_take_seat_does_not_overbook(self):
+        training = create_training(max_participants=5)
+        barrier = threading.Barrier(self.threads)
+        results = []
+
+        def worker():
+            try:
+                barrier.wait()
+                results.append(take_seat(training.pk))
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        training.refresh_from_db()
+        self.assertEqual(len(results), self.threads)
+        self.assertLessEqual(training.current_participants, training.max_participants)
+        self.assertEqual(results.count(True), training.max_participants)
+        self.assertEqual(training.current_participants, training.max_participants)
+
+
+class TrainingEnrollViewConcurrencyTest(TransactionTestCase):
+    """
+    Параллельные запросы на запись через TrainingEnrollView: записываются
+    ровно max_participants пользователей, остальные попадают в резерв.
+    """
+    threads = 10
+
+    def test_parallel_enroll_fills_training_exactly(self):
+        training = create_training(max_participants=3)
+        users = [CustomUser.objects.create_user(f'enroll{number}@example.com', 'password')
+                 for number in range(self.threads)]
+        for user in users:
+            create_subscription(user, training)
+        barrier = threading.Barrier(self.threads)
+        responses = []
+
+        def worker(user):
+            try:
+                client = APIClient(SERVER_NAME='localhost')
+                client.force_authenticate(user)
+                barrier.wait()
+                responses.append(client.post(f'/trainings/{training.pk}/enroll/'))
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker, args=(user,)) for user in users]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        training.refresh_from_db()
+        messages = [response.data.get('success') for response in responses]
+        self.assertEqual([response.status_code for response in responses], [200] * self.threads)
+        self.assertEqual(messages.count('Вы записались на тренировку'), 3)
+        self.assertEqual(messages.count('Вы добавлены в резерв'), self.threads - 3)
+        self.assertEqual(training.current_participants, 3)
+        self.assertEqual(Reservation.objects.filter(training=training).count(), 3)
+        self.assertEqual(WaitlistEntry.objects.filter(training=training).count(), self.threads - 3)
+
+
+class TrainingEnrollViewTest(TestCase):
+    """
+    Отказ после take_seat откатывает транзакцию, и место освобождается.
+    """
+
+    def setUp(self):
+        self.training = create_training(max_participants=1)
+        self.user = CustomUser.objects.create_user('enroll@example.com', 'password')
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(self.user)
+
+    def assert_seat_released(self, response, status_code):
+        self.training.refresh_from_db()
+        self.assertEqual(response.status_code, status_code)
+        self.assertEqual(self.training.current_participants, 0)
+        self.assertFalse(Reservation.objects.filter(training=self.training).exists())
+
+    def test_failed_debit_releases_seat(self):
+        subscription = create_subscription(self.user, self.training, trainings_left=0)
+        response = self.client.post(f'/trainings/{self.training.pk}/enroll/')
+        self.assert_seat_released(response, 403)
+        subscription.refresh_from_db()
+        self.assertEqual(subscription.trainings_left, 0)
+
+    def test_missing_subscription_releases_seat(self):
+        response = self.client.post(f'/trainings/{self.training.pk}/enroll/')
+        self.assert_seat_released(response, 403)
+
+    def test_enroll_debits_subscription(self):
+        subscription = create_subscription(self.user, self.training, trainings_left=1)
+        response = self.client.post(f'/trainings/{self.training.pk}/enroll/')
+        self.assertEqual(response.status_code, 200)
+        subscription.refresh_from_db()
+        self.training.refresh_from_db()
+        self.assertEqual(subscription.trainings_left, 0)
+        self.assertEqual(self.training.current_participants, 1)
+
+
+class EnrollSubscriptionConcurrencyTest(TransactionTestCase):
+    """
+    Параллельная запись по одному абонементу: каждый поток со своим
+    экземпляром Subscription, остаток не уходит в минус.
+    """
+    threads = 4
+
+    def test_parallel_enroll_does_not_overspend(self):
+        trainings = [create_training(days=number + 1) for number in range(5)]
+        user = CustomUser.objects.create_user('subscriber@example.com', 'password')
+        subscription = create_subscription(user, trainings[0], trainings_left=2)
+        barrier = threading.Barrier(self.threads)
+        errors = []
+
+        def worker():
+            try:
+                instance = Subscription.objects.select_related('user').get(pk=subscription.pk)
+                barrier.wait()
+                enroll_subscription(instance)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        subscription.refresh_from_db()
+        self.assertEqual(errors, [])
+        self.assertEqual(subscription.trainings_left, 0)
+        self.assertEqual(Reservation.objects.filter(user=user).count(), 2)
+
+
+class TrainingListQueriesTest(TestCase):
+    """
+    Число запросов списка тренировок не зависит от числа тренировок
+    и участников на них.
+    """
+
+    def setUp(self):
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.user = CustomUser.objects.create_user('user@example.com', 'password')
+        self.participants = [
+            CustomUser.objects.create_user(f'participant{number}@example.com', 'password')
+            for number in range(5)
+        ]
+
+    def create_trainings(self, count):
+        for number in range(count):
+            training = create_training(days=number + 1)
+            Reservation.objects.bulk_create([
+                Reservation(training=training, user=user) for user in self.participants])
+            training.current_participants = len(self.participants)
+            training.save(update_fields=['current_participants'])
+
+    def assert_list_queries(self, count, queries):
+        self.create_trainings(count)
+        with self.assertNumQueries(queries):
+            response = self.client.get('/trainings/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), count)
+
+    def test_anonymous_list_queries(self):
+        self.assert_list_queries(3, 1)
+
+    def test_anonymous_list_queries_do_not_grow(self):
+        self.assert_list_queries(20, 1)
+
+    def test_authenticated_list_queries(self):
+        self.client.force_authenticate(self.user)
+        Reservation.objects.create(training=create_training(), user=self.user)
+        with self.assertNumQueries(1):
+            response = self.client.get('/trainings/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['results'][0]['is_enrolled'])
+
+    def test_authenticated_list_queries_do_not_grow(self):
+        self.client.force_authenticate(self.user)
+        self.assert_list_queries(20, 1)
+
+
+class ViewQueriesTest(TestCase):
+    """
+    Бюджет запросов остальных списков и карточки тренировки: связанные
+    строки загружаются select_related/prefetch_related, а не по одной.
+    """
+
+    def setUp(self):
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.user = CustomUser.objects.create_user('user@example.com', 'password')
+
+    def test_trainer_list(self):
+        for number in range(5):
+            Trainer.objects.create(user=CustomUser.objects.create_user(
+                f'trainer{number}@example.com', 'password', role='trainer'))
+        with self.assertNumQueries(1):
+            response = self.client.get('/trainers/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 5)
+
+    def test_training_detail(self):
+        training = create_training()
+        Reservation.objects.bulk_create([
+            Reservation(training=training, user=CustomUser.objects.create_user(
+                f'participant{number}@example.com', 'password'))
+            for number in range(5)
+        ])
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/trainings/{training.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['participants']), 5)
+
+    def test_subscription_list(self):
+        trainings = [create_training(days=number + 1) for number in range(5)]
+        for training in trainings:
+            create_subscription(self.user, training)
+        self.client.force_authenticate(self.user)
+        with self.assertNumQueries(1):
+            response = self.client.get('/subscriptions/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 5)
+
+
+class AmoCRMStandIn(ThreadingHTTPServer):
+    """
+    Локальная замена API AmoCRM: создаёт контакты с последовательными id,
+    запоминает размеры пачек и отвечает заданными кодами на очередные POST.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), AmoCRMHandler)
+        self.requests = []
+        self.post_statuses = []
+        self.next_id = 1000
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f'http://{host}:{port}'
+
+
+class AmoCRMHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body=None, headers=()):
+        data = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_batch(self):
+        batch = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.requests.append((self.command, len(batch)))
+        return batch
+
+    def do_POST(self):
+        batch = self.read_batch()
+        status = self.server.post_statuses.pop(0) if self.server.post_statuses else 200
+        if status == 429:
+            return self.reply(429, {}, headers=[('Retry-After', '0')])
+        if status != 200:
+            return self.reply(status, {})
+        contacts = []
+        for contact in batch:
+            self.server.next_id += 1
+            contacts.append({'id': self.server.next_id, 'request_id': contact['request_id']})
+        self.reply(200, {'_embedded': {'contacts': contacts}})
+
+    def do_PATCH(self):
+        self.read_batch()
+        self.reply(200, {})
+
+
+class PushNotificationsTest(TestCase):
+    """
+    push_notifications против локальной замены AmoCRM.
+    """
+
+    def setUp(self):
+        self.server = AmoCRMStandIn()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.client = AmoCRMClient(
+            self.server.url, 'token', rate_limit=1000, batch_size=250, timeout=(1, 5), pool_size=1)
+
+    def create_users(self, count):
+        return CustomUser.objects.bulk_create([
+            CustomUser(email=f'crm{number}@example.com', username=f'crm{number}@example.com',
+                       first_name=f'User {number}')
+            for number in range(count)
+        ])
+
+    def test_retries_after_429(self):
+        users = self.create_users(3)
+        self.server.post_statuses = [429]
+        push_notifications([(user, 'Текст') for user in users], client=self.client)
+        self.assertEqual(self.server.requests, [('POST', 3), ('POST', 3)])
+        self.assertEqual(CrmContact.objects.count(), 3)
+
+    def test_batches_of_250(self):
+        users = self.create_users(600)
+        push_notifications([(user, 'Текст') for user in users], client=self.client)
+        self.assertEqual(self.server.requests, [('POST', 250), ('POST', 250), ('POST', 100)])
+        self.assertEqual(CrmContact.objects.count(), 600)
+
+        # Повторные уведомления обновляют уже созданные контакты
+        self.server.requests.clear()
+        push_notifications([(user, 'Ещё текст') for user in users], client=self.client)
+        self.assertEqual(self.server.requests, [('PATCH', 250), ('PATCH', 250), ('PATCH', 100)])
+
+    def test_partial_failure_keeps_created_contacts(self):
+        users = self.create_users(600)
+        self.server.post_statuses = [200, 500]
+        with self.assertRaises(requests.HTTPError):
+            push_notifications([(user, 'Текст') for user in users], client=self.client)
+        self.assertEqual(CrmContact.objects.count(), 250)
+
+        # Повтор создаёт только контакты, которых ещё нет
+        self.server.requests.clear()
+        push_notifications([(user, 'Текст') for user in users], client=self.client)
+        self.assertEqual(self.server.requests, [('PATCH', 250), ('POST', 250), ('POST', 100)])
+        self.assertEqual(CrmContact.objects.count(), 600)
+        self.assertEqual(CrmContact.objects.values('contact_id').distinct().count(), 600)
+
+
+class IdempotentView(APIView):
+    calls = 0
+    crash = False
+
+    @idempotent
+    def post(self, request):
+        IdempotentView.calls += 1
+        if IdempotentView.crash:
+            # Имитирует гибель процесса: исключение не перехватывается как Exception
+            raise SystemExit
+        return Response({'call': IdempotentView.calls}, status=201)
+
+
+class IdempotencyTest(TestCase):
+
+    def setUp(self):
+        IdempotentView.calls = 0
+        IdempotentView.crash = False
+        self.factory = APIRequestFactory()
+
+    def post(self, data, key='key-1'):
+        request = self.factory.post('/idempotent/', data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+        return IdempotentView.as_view()(request)
+
+    def test_replays_stored_response(self):
+        first = self.post({'a': 1, 'b': 2})
+        second = self.post({'b': 2, 'a': 1})
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.data, {'call': 1})
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(IdempotentView.calls, 1)
+
+    def test_rejects_other_body_with_same_key(self):
+        self.post({'a': 1})
+        response = self.post({'a': 2})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(IdempotentView.calls, 1)
+
+    def test_stale_claim_is_taken_over(self):
+        IdempotentView.crash = True
+        with self.assertRaises(SystemExit):
+            self.post({'a': 1})
+        IdempotentView.crash = False
+
+        # Пока аренда не истекла, запрос считается выполняющимся
+        self.assertEqual(self.post({'a': 1}).status_code, 409)
+
+        IdempotencyKey.objects.update(locked_until=timezone.now() - datetime.timedelta(seconds=1))
+        response = self.post({'a': 1})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(IdempotentView.calls, 2)
+        self.assertEqual(self.post({'a': 1})['Idempotent-Replayed'], 'true')
+
+    def test_create_payment_with_key(self):
+        # CreatePaymentView сам читает request.body после проверки ключа
+        client = APIClient(SERVER_NAME='localhost')
+        payment = mock.Mock()
+        payment.confirmation.confirmation_url = 'https://yookassa.example.com/pay/1'
+        body = {'amount': 1000, 'recipient_account_id': '123', 'recipient_amount': 500}
+        with mock.patch('backend.views.Payment.create', return_value=payment) as create:
+            first = client.post('/create_payment/', body, format='json', HTTP_IDEMPOTENCY_KEY='pay-1')
+            second = client.post('/create_payment/', body, format='json', HTTP_IDEMPOTENCY_KEY='pay-1')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.data, {'payment_url': 'https://yookassa.example.com/pay/1'})
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(create.call_count, 1)
+
+
+class EnrollmentTicketTest(TestCase):
+
+    def test_over_capacity_training_reserves_instead_of_enrolling(self):
+        # Тренировка переполнена: max_participants уменьшили после записи
+        training = create_training(max_participants=1)
+        Training.objects.filter(pk=training.pk).update(current_participants=2)
+        user = CustomUser.objects.create_user('ticket@example.com', 'password')
+        subscription = create_subscription(user, training)
+        ticket = EnrollmentTicket.objects.create(training=training, user=user)
+
+        self.assertEqual(process_enrollment_tickets(training.pk), 1)
+
+        ticket.refresh_from_db()
+        training.refresh_from_db()
+        subscription.refresh_from_db()
+        self.assertEqual(ticket.status, 'reserved')
+        self.assertEqual(training.current_participants, 2)
+        self.assertEqual(subscription.trainings_left, 5)
+        self.assertTrue(WaitlistEntry.objects.filter(training=training, user=user).exists())
+
+
+class SeriesUpdateTest(TestCase):
+    """
+    Еженедельная серия из шести тренировок (COUNT=6), начиная со следующей недели.
+    """
+
+    def setUp(self):
+        start = timezone.localtime() + datetime.timedelta(days=7)
+        self.series = create_training()
+        self.series.date = start.replace(hour=10, minute=0, second=0, microsecond=0)
+        self.series.is_recurring = True
+        self.series.recurrence_rule = 'FREQ=WEEKLY;COUNT=6'
+        self.series.save()
+        materialize_series(self.series)
+        self.trainings = list(Training.objects.filter(
+            Q(pk=self.series.pk) | Q(parent_training=self.series)).order_by('date'))
+        self.days = [timezone.localtime(training.date).date() for training in self.trainings]
+
+    def levels(self):
+        return [training.level for training in Training.objects.filter(
+            pk__in=[training.pk for training in self.trainings]).order_by('date')]
+
+    def test_series_has_six_trainings(self):
+        self.assertEqual(len(self.trainings), 6)
+
+    def test_update_all(self):
+        training_ids = update_series(self.series, {'level': 3}, scope='all')
+        self.assertEqual(sorted(training_ids), sorted(training.pk for training in self.trainings))
+        self.assertEqual(self.levels(), [3] * 6)
+
+    def test_update_following_splits_series(self):
+        training_ids = update_series(self.series, {'level': 3}, scope='following', day=self.days[3])
+        self.assertEqual(sorted(training_ids), sorted(training.pk for training in self.trainings[3:]))
+        self.assertEqual(self.levels(), [1, 1, 1, 3, 3, 3])
+
+        head = self.trainings[3]
+        head.refresh_from_db()
+        self.series.refresh_from_db()
+        self.assertIsNone(head.parent_training_id)
+        self.assertEqual(head.recurrence_rule, 'FREQ=WEEKLY;COUNT=3')
+        self.assertEqual(self.series.recurrence_end_date, self.days[3] - datetime.timedelta(days=1))
+        self.assertEqual(Training.objects.filter(parent_training=head).count(), 2)
+
+    def test_split_carries_over_count(self):
+        head = split_series(self.series, self.days[3])
+        self.assertEqual(head.recurrence_rule, 'FREQ=WEEKLY;COUNT=3')
+        # Повторения после дня деления уже есть — новых не создаётся
+        self.assertEqual(materialize_series(head), [])
+
+    def test_split_after_last_day_is_refused(self):
+        with self.assertRaises(ValueError):
+            split_series(self.series, self.days[-1] + datetime.timedelta(weeks=1))
+
+    def test_max_participants_below_current_is_rejected(self):
+        overfull = self.trainings[2]
+        Training.objects.filter(pk=overfull.pk).update(current_participants=5)
+        with self.assertRaises(SeriesCapacityError) as raised:
+            update_series(self.series, {'max_participants': 3}, scope='all')
+        self.assertEqual(raised.exception.training_ids, [overfull.pk])
+        self.assertFalse(Training.objects.filter(
+            pk__in=[training.pk for training in self.trainings], max_participants=3).exists())
+
+    def test_series_view_reports_overfull_trainings(self):
+        overfull = self.trainings[2]
+        Training.objects.filter(pk=overfull.pk).update(current_participants=5)
+        client = APIClient(SERVER_NAME='localhost')
+        client.force_authenticate(CustomUser.objects.create_user('admin@example.com', 'password', role='admin'))
+        response = client.patch(f'/trainings/{self.series.pk}/series/',
+                                {'scope': 'all', 'max_participants': 3}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['training_ids'], [overfull.pk])
+
+    def test_max_participants_check_respects_scope(self):
+        # Переполненная тренировка остаётся в старой серии
+        Training.objects.filter(pk=self.trainings[1].pk).update(current_participants=5)
+        training_ids = update_series(
+            self.series, {'max_participants': 3}, scope='following', day=self.days[3])
+        self.assertEqual(len(training_ids), 3)
+
+
+class RecurrenceRuleTest(SimpleTestCase):
+    # 2026-11-02 — понедельник
+    monday = datetime.date(2026, 11, 2)
+
+    def test_parse_round_trip(self):
+        rule = RecurrenceRule.parse('freq=weekly;interval=2;byday=th,mo;until=20261231')
+        self.assertEqual(str(rule), 'FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,TH;UNTIL=20261231')
+        self.assertEqual(str(RecurrenceRule.parse('FREQ=DAILY;COUNT=3')), 'FREQ=DAILY;COUNT=3')
+
+    def test_parse_errors(self):
+        for text in ('FREQ=MONTHLY', 'FREQ=WEEKLY;BYDAY=XX', 'FREQ=WEEKLY;COUNT=two',
+                     'FREQ=WEEKLY;UNTIL=2026', 'FREQ=WEEKLY;COUNT=0', 'FREQ=WEEKLY;INTERVAL=0',
+                     'FREQ=WEEKLY;BYMONTH=1', 'FREQ=WEEKLY;COUNT'):
+            with self.subTest(text=text), self.assertRaises(ValueError):
+                RecurrenceRule.parse(text)
+
+    def test_weekly_byday_interval_until(self):
+        rule = RecurrenceRule.parse('FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,TH;UNTIL=20261130')
+        self.assertEqual(list(rule.dates(self.monday)), [
+            datetime.date(2026, 11, 2), datetime.date(2026, 11, 5),
+            datetime.date(2026, 11, 16), datetime.date(2026, 11, 19),
+            datetime.date(2026, 11, 30),
+        ])
+
+    def test_daily_interval_count(self):
+        rule = RecurrenceRule.parse('FREQ=DAILY;INTERVAL=3;COUNT=3')
+        self.assertEqual(list(rule.dates(self.monday)), [
+            datetime.date(2026, 11, 2), datetime.date(2026, 11, 5), datetime.date(2026, 11, 8)])
+
+    def test_exdates_count_towards_count(self):
+        rule = RecurrenceRule.parse('FREQ=WEEKLY;COUNT=4')
+        dates = list(rule.dates(self.monday, exdates=[datetime.date(2026, 11, 9)]))
+        self.assertEqual(dates, [
+            datetime.date(2026, 11, 2), datetime.date(2026, 11, 16), datetime.date(2026, 11, 23)])
+        self.assertEqual(rule.count_before(self.monday, datetime.date(2026, 11, 23)), 3)
+
+    def test_unbounded_rule_needs_until(self):
+        rule = RecurrenceRule.parse('FREQ=WEEKLY')
+        self.assertFalse(rule.is_bounded)
+        self.assertEqual(len(list(rule.dates(self.monday, until=datetime.date(2026, 11, 30)))), 5)
+
+    def test_start_outside_byday_counts_towards_count(self):
+        rule = RecurrenceRule.parse('FREQ=WEEKLY;BYDAY=TU,TH;COUNT=4')
+        self.assertEqual(list(rule.dates(self.monday)), [
+            datetime.date(2026, 11, 2), datetime.date(2026, 11, 3),
+            datetime.date(2026, 11, 5), datetime.date(2026, 11, 10),
+        ])
+
+        # Голова серии — первая из COUNT тренировок, повторений ещё три
+        start = timezone.make_aware(datetime.datetime.combine(self.monday, datetime.time(10)))
+        series = Training(date=start, is_recurring=True, recurrence_rule=str(rule))
+        self.assertEqual(len(list(series_dates(series))), 3)
+
+
+class AutoEnrollTest(TestCase):
+
+    def test_new_training_is_filled_by_priority_within_capacity(self):
+        training = create_training(max_participants=2)
+        subscriptions = [
+            create_subscription(CustomUser.objects.create_user(f'auto{number}@example.com', 'password'),
+                                training, reserve_priority=priority)
+            for number, priority in enumerate([0, 5, 1])
+        ]
+
+        allocations = auto_enroll_trainings([training])
+
+        training.refresh_from_db()
+        self.assertEqual(training.current_participants, 2)
+        self.assertEqual([subscription_id for _, subscription_id, _ in allocations],
+                         [subscriptions[1].pk, subscriptions[2].pk])
+        self.assertEqual(set(Reservation.objects.filter(training=training).values_list('user_id', flat=True)),
+                         {subscriptions[1].user_id, subscriptions[2].user_id})
+        left = dict(Subscription.objects.values_list('pk', 'trainings_left'))
+        self.assertEqual([left[subscription.pk] for subscription in subscriptions], [5, 4, 4])
+        # Повторный вызов идемпотентен: мест больше нет
+        self.assertEqual(auto_enroll_trainings([training]), [])
+
+
+class AllocateSeatsTest(SimpleTestCase):
+    """
+    Распределение мест месячного прогона (monthly_rollover) без базы.
+    """
+    day = datetime.date(2026, 11, 2)
+
+    def training(self, pk, free, days=0):
+        day = self.day + datetime.timedelta(days=days)
+        return TrainingSlot(id=pk, gym_id=1, level=1, gender='any', day=day,
+                            weekday=day.weekday(), month_key=day.year * 100 + day.month, free=free)
+
+    def subscription(self, pk, priority=0, **fields):
+        values = dict(id=pk, user_id=pk, gym_id=1, level=1, gender='male', weekday_mask=0, months=frozenset(),
+                      start_date=self.day, end_date=self.day + datetime.timedelta(days=30), priority=priority)
+        values.update(fields)
+        return SubscriptionSlot(**values)
+
+    def test_respects_capacity_and_priority(self):
+        trainings = [self.training(1, free=1), self.training(2, free=2, days=1)]
+        subscriptions = [self.subscription(10), self.subscription(11), self.subscription(12, priority=1)]
+        seats_left = {10: 2, 11: 1, 12: 1}
+
+        allocations = allocate_seats(trainings, subscriptions, seats_left)
+
+        self.assertEqual(allocations, [(1, 12, 12), (2, 10, 10), (2, 11, 11)])
+        self.assertEqual(seats_left, {10: 1, 11: 0, 12: 0})
+
+    def test_spreads_seats_between_equal_subscriptions(self):
+        trainings = [self.training(1, free=1), self.training(2, free=1, days=1)]
+        subscriptions = [self.subscription(10), self.subscription(11)]
+
+        allocations = allocate_seats(trainings, subscriptions, {10: 5, 11: 5})
+
+        self.assertEqual(allocations, [(1, 10, 10), (2, 11, 11)])
+
+    def test_skips_enrolled_uncovered_and_exhausted(self):
+        trainings = [self.training(1, free=3)]
+        subscriptions = [
+            self.subscription(10),
+            self.subscription(11, start_date=self.day + datetime.timedelta(days=1)),
+            self.subscription(12),
+            self.subscription(13, level=2),
+        ]
+
+        allocations = allocate_seats(trainings, subscriptions, {10: 1, 11: 1, 12: 0, 13: 1}, enrolled={(1, 10)})
+
+        self.assertEqual(allocations, [])
+
+
+class WaitlistPromotionTest(TestCase):
+
+    def test_expired_reservation_promotes_first_waitlist_entry(self):
+        training = create_training(max_participants=1)
+        holder, first, second = [
+            CustomUser.objects.create_user(f'wait{number}@example.com', 'password') for number in range(3)]
+        for user in (holder, first, second):
+            create_subscription(user, training)
+        Reservation.objects.create(
+            training=training, user=holder, expire_at=timezone.now() - datetime.timedelta(minutes=1))
+        Training.objects.filter(pk=training.pk).update(current_participants=1)
+        WaitlistEntry.objects.create(training=training, user=first)
+        WaitlistEntry.objects.create(training=training, user=second)
+
+        expired = cancel_expired_reservations()
+
+        training.refresh_from_db()
+        self.assertEqual([reservation.user_id for reservation in expired], [holder.pk])
+        self.assertEqual(training.current_participants, 1)
+        self.assertEqual(list(Reservation.objects.filter(training=training).values_list('user_id', flat=True)),
+                         [first.pk])
+        self.assertEqual(list(WaitlistEntry.objects.filter(training=training).values_list('user_id', flat=True)),
+                         [second.pk])
+        self.assertEqual(Subscription.objects.get(user=first).trainings_left, 4)
+
+
+class ClaimJobsConcurrencyTest(TransactionTestCase):
+    """
+    Несколько воркеров разбирают очередь одновременно: SKIP LOCKED не
+    выдаёт одну задачу двоим.
+    """
+    threads = 5
+
+    def test_each_job_is_claimed_once(self):
+        jobs = [enqueue('backend.tasks.purge_idempotency_keys') for _ in range(60)]
+        barrier = threading.Barrier(self.threads)
+        claimed = []
+
+        def worker(name):
+            try:
+                barrier.wait()
+                while batch := claim_jobs(name, limit=4):
+                    claimed.extend(job.pk for job in batch)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker, args=(f'worker-{number}',)) for number in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        self.assertEqual(sorted(claimed), sorted(job.pk for job in jobs))
+        self.assertEqual(Job.objects.filter(status='running', attempts=1).count(), len(jobs))
+
+
+class RunJobTest(TestCase):
+
+    def test_unknown_task_fails_on_first_attempt(self):
+        enqueue('backend.tasks.no_such_task', max_attempts=5)
+        job, = claim_jobs('worker')
+
+        self.assertFalse(run_job(job))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.attempts, 1)
+        self.assertIn('not a registered task', job.last_error)
+
+
+class OutboxDrainTest(TestCase):
+    handler = 'backend.enrollment.enroll_paid_subscriptions'
+
+    def publish(self, count):
+        return publish_many('subscription.paid', [{'subscription_id': number} for number in range(count)])
+
+    def test_leased_events_are_retried_after_expiry(self):
+        events = self.publish(2)
+        # Запуск, который взял события и упал, не отметив их
+        self.assertEqual(len(claim(10)), 2)
+
+        with mock.patch(self.handler, return_value=None) as handler:
+            self.assertEqual(drain(), 0)
+            OutboxEvent.objects.update(locked_until=timezone.now() - datetime.timedelta(seconds=1))
+            self.assertEqual(drain(), 2)
+        handler.assert_called_once_with([event.payload for event in events])
+        self.assertFalse(OutboxEvent.objects.filter(dispatched_at__isnull=True).exists())
+        self.assertEqual(list(OutboxEvent.objects.values_list('attempts', 'locked_until')), [(2, None)] * 2)
+
+    def test_only_failed_events_are_retried(self):
+        events = self.publish(3)
+        with mock.patch(self.handler, return_value={1: 'boom'}):
+            self.assertEqual(drain(), 2)
+        failed = OutboxEvent.objects.get(dispatched_at__isnull=True)
+        self.assertEqual(failed.pk, events[1].pk)
+        self.assertEqual((failed.attempts, failed.last_error, failed.locked_until), (1, 'boom', None))
+
+        with mock.patch(self.handler, return_value=None) as handler:
+            self.assertEqual(drain(), 1)
+        handler.assert_called_once_with([events[1].payload])
+
+    def test_group_failure_falls_back_to_single_events(self):
+        self.publish(3)
+
+        def handler(payloads):
+            if len(payloads) > 1 or payloads[0]['subscription_id'] == 1:
+                raise RuntimeError('boom')
+
+        with mock.patch(self.handler, side_effect=handler):
+            self.assertEqual(drain(), 2)
+        self.assertEqual(list(OutboxEvent.objects.filter(dispatched_at__isnull=True).values_list(
+            'payload', flat=True)), [{'subscription_id': 1}])
+
+
+class FlakySMTPHandler(SMTPHandler):
+    """
+    SMTP-сервер, который рвёт соединение на письмах с номерами из
+    server.drop_on и запоминает получателей доставленных писем.
+    """
+
+    def handle(self):
+        self.reply('220 localhost ESMTP test')
+        recipients = []
+        for raw in self.rfile:
+            command = raw.decode(errors='replace').strip()
+            upper = command.upper()
+            if upper.startswith(('EHLO', 'HELO')):
+                self.reply('250 localhost')
+            elif upper.startswith('RCPT'):
+                recipients.append(command.split(':', 1)[1].strip('<> '))
+                self.reply('250 OK')
+            elif upper == 'DATA':
+                self.server.attempts += 1
+                if self.server.attempts in self.server.drop_on:
+                    return
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                for line in self.rfile:
+                    if line in (b'.\r\n', b'.\n'):
+                        break
+                self.server.delivered.extend(recipients)
+                recipients = []
+                self.reply('250 OK')
+            elif upper == 'QUIT':
+                self.reply('221 Bye')
+                break
+            else:
+                self.reply('250 OK')
+
+
+class SendMessagesTest(SimpleTestCase):
+
+    def setUp(self):
+        self.server = SMTPServer(0)
+        self.server.RequestHandlerClass = FlakySMTPHandler
+        self.server.attempts = 0
+        self.server.drop_on = set()
+        self.server.delivered = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        host, port = self.server.server_address
+        self.connection = get_connection('django.core.mail.backends.smtp.EmailBackend', host=host, port=port,
+                                         username='', password='', use_tls=False, use_ssl=False)
+        self.messages = [EmailMessage('Тема', 'Текст', 'from@example.com', [f'user{number}@example.com'])
+                         for number in range(12)]
+        self.recipients = [message.to[0] for message in self.messages]
+
+    def send(self, messages, **kwargs):
+        return send_messages(messages, chunk_size=5, backoff=0.01, connection=self.connection, **kwargs)
+
+    def test_dropped_connection_resumes_without_duplicates(self):
+        self.server.drop_on = {4, 9}
+        result = self.send(self.messages)
+        self.assertEqual((result.sent, result.failed), (12, {}))
+        self.assertEqual(self.server.delivered, self.recipients)
+
+    def test_exhausted_retries_report_only_unsent_messages(self):
+        # Письмо 7 (индекс 6) обрывается дважды: повтор не помогает
+        self.server.drop_on = {7, 8}
+        result = self.send(self.messages, retries=1)
+        self.assertEqual(result.sent, 6)
+        self.assertEqual(sorted(result.failed), list(range(6, 12)))
+
+        # Повтор отправляет только недоставленные письма
+        retry = self.send([self.messages[index] for index in sorted(result.failed)])
+        self.assertEqual((retry.sent, retry.failed), (6, {}))
+        self.assertEqual(self.server.delivered, self.recipients)
@@ -5,7 +5,9 @@ from .views import (
     RegisterView, LoginView, ProfileView, GymListView, GymDetailView, TrainingListView,
     SubscriptionListView, TrainingFeedbackListView, TrainerListView,
     TrainerDetailView, TrainingDetailView, TrainingEnrollView, TrainingUnenrollView, ManageRecurringTrainingsView,
-    SubscriptionDetailView, CreateSubscriptionView, CreatePaymentView, payment_webhook, TrainingConfirmView, TrainerPhotoUpdateView, TrainerPhotoDeleteView
+    SubscriptionDetailView, CreateSubscriptionView, CreatePaymentView, payment_webhook, TrainingConfirmView, TrainerPhotoUpdateView, TrainerPhotoDeleteView,
+    EnrollmentTicketDetailView, TrainingRosterView, TrainingScheduleView, TrainingOccurrenceView,
+    TrainingSeriesView, NotificationListView, NotificationUnreadCountView, NotificationReadView
 )
 from django.conf import settings
 from django.conf.urls.static import static
@@ -19,13 +21,23 @@ urlpatterns = [
     path('gyms/', GymListView.as_view(), name='gym-list'),
     path('gyms/<int:pk>/', GymDetailView.as_view(), name='gym-detail'),
     path('trainings/', TrainingListView.as_view(), name='training-list'),
+    path('trainings/schedule/', TrainingScheduleView.as_view(),
+         name='training-schedule'),
     path('trainings/<int:pk>/', TrainingDetailView.as_view(), name='training-detail'),
+    path('trainings/<int:pk>/series/', TrainingSeriesView.as_view(),
+         name='training-series'),
+    path('trainings/<int:pk>/occurrences/<str:day>/',
+         TrainingOccurrenceView.as_view(), name='training-occurrence'),
     path('trainings/<int:pk>/enroll/',
          TrainingEnrollView.as_view(), name='training-enroll'),
     path('trainings/<int:pk>/unenroll/',
          TrainingUnenrollView.as_view(), name='training-unenroll'),
     path('trainings/<int:pk>/confirm/', TrainingConfirmView.as_view(),
          name='training-confirm'),  # Добавлен маршрут для подтверждения записи
+    path('trainings/<int:pk>/roster/', TrainingRosterView.as_view(),
+         name='training-roster'),
+    path('enrollment-tickets/<int:pk>/', EnrollmentTicketDetailView.as_view(),
+         name='enrollment-ticket-detail'),
     path('subscriptions/', SubscriptionListView.as_view(),
          name='subscription-list'),
     path('subscriptions/<int:pk>/', SubscriptionDetailView.as_view(),
@@ -48,6 +60,10 @@ urlpatterns = [
     path('webhook/payment/', payment_webhook, name='payment_webhook'),
     path('trainers/<int:trainer_id>/photo/delete/',
          TrainerPhotoDeleteView.as_view(), name='trainer-photo-delete'),
+    path('notifications/', NotificationListView.as_view(), name='notification-list'),
+    path('notifications/unread-count/', NotificationUnreadCountView.as_view(),
+         name='notification-unread-count'),
+    path('notifications/read/', NotificationReadView.as_view(), name='notification-read'),
 ]
 
 if settings.DEBUG:
@@ -0,0 +1,10 @@
+import datetime
+
+from django.utils import timezone
+
+
+def start_of_day(value):
+    """
+    Начало суток для даты в текущем часовом поясе (aware datetime).
+    """
+    return timezone.make_aware(datetime.datetime.combine(value, datetime.time.min))
@@ -2,15 +2,17 @@ from .models import Subscription
 from rest_framework import generics, permissions, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from .models import Profile, Gym, Training, Subscription, TrainingFeedback, Trainer, CustomUser
-from .serializers import UserSerializer, LoginSerializer, GymSerializer, TrainingSerializer, SubscriptionSerializer, TrainingFeedbackSerializer, TrainerSerializer
+from .models import Profile, Gym, Training, Subscription, TrainingFeedback, Trainer, CustomUser, WaitlistEntry, EnrollmentTicket, Reservation, Notification
+from .serializers import UserSerializer, LoginSerializer, GymSerializer, TrainingSerializer, TrainingListSerializer, ScheduleItemSerializer, EnrollmentTicketSerializer, NotificationSerializer, NotificationReadSerializer, RosterMemberSerializer, RosterUpdateSerializer, SeriesUpdateSerializer, SubscriptionSerializer, TrainingFeedbackSerializer, TrainerSerializer
 from rest_framework.authtoken.models import Token
 from django.contrib.auth import authenticate
 from .permissions import IsAdminUser, IsTrainerUser, IsRegularUser
 from rest_framework.permissions import AllowAny
 from django.utils import timezone
 from .payment import create_split_payment
-from django.db import transaction
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef, Prefetch, Q
+import datetime
 import logging
 from decimal import Decimal
 import requests
@@ -27,12 +29,27 @@ from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 import json
 from django.core.files.base import ContentFile
 import base64
+from django_filters.rest_framework import DjangoFilterBackend
+from .filters import TrainingFilter
+from .pagination import NotificationCursorPagination, TrainingCursorPagination
+from .utils import start_of_day
+from .outbox import publish, publish_many
+from .amocrm import get_client as get_amocrm_client
+from .inbox import mark_read, notify, unread_count
+from .idempotency import idempotent
+from .enrollment import apply_roster_operations, auto_enroll_trainings, is_enrolled, promote_waitlist, schedule_confirmations, take_seat
+from .recurrence import SeriesCapacityError, cancel_occurrence, exclude_day, generate_schedule, materialize_occurrence, materialize_series, update_series, virtual_occurrences
 
 logger = logging.getLogger(__name__)
 
 Configuration.account_id = settings.YOOKASSA_SHOP_ID
 Configuration.secret_key = settings.YOOKASSA_SECRET_KEY
 
+# Поля участника, которые читает UserSerializer в составе тренировки
+PARTICIPANT_FIELDS = ('id', 'first_name', 'last_name', 'middle_name', 'email', 'phone', 'birth_date', 'gender',
+                      'passport_data', 'experience_years', 'bio', 'sports_title', 'photo', 'role', 'level',
+                      'sports_category')
+
 
 @csrf_exempt
 def payment_webhook(request):
@@ -46,16 +63,17 @@ def payment_webhook(request):
                 try:
                     subscription = Subscription.objects.get(
                         payment_id=payment_id)
-                    if not subscription.is_paid:
-                        logger.info(
-                            f"Marking subscription {payment_id} as paid")
-                        subscription.is_paid = True
-                        subscription.save()
-                        logger.info(
-                            f"Calling enroll_user_to_trainings for subscription {payment_id}")
-                        subscription.enroll_user_to_trainings()
+                    # Условный UPDATE: повторный вебхук не поставит запись дважды,
+                    # а сама запись на тренировки выполнится через outbox
+                    with transaction.atomic():
+                        marked = Subscription.objects.filter(
+                            pk=subscription.pk, is_paid=False).update(is_paid=True)
+                        if marked:
+                            publish('subscription.paid',
+                                    subscription_id=subscription.pk)
+                    if marked:
                         logger.info(
-                            f"Subscription {payment_id} marked as paid and user enrolled to trainings")
+                            f"Subscription {payment_id} marked as paid, enrollment queued")
                     else:
                         logger.info(
                             f"Subscription {payment_id} was already marked as paid")
@@ -79,6 +97,7 @@ def payment_webhook(request):
 
 @method_decorator(csrf_protect, name='dispatch')
 class CreatePaymentView(APIView):
+    @idempotent
     def post(self, request):
         try:
             data = json.loads(request.body)
@@ -155,27 +174,19 @@ def amocrm_callback(request):
     if not auth_code:
         return JsonResponse({"error": "Authorization code not provided"}, status=400)
 
-    # Параметры для получения токенов
-    url = "https://ilya33533.amocrm.ru/oauth2/access_token"
-    data = {
-        "client_id": "11593038",
-        "client_secret": "YOUR_CLIENT_SECRET",
-        "grant_type": "authorization_code",
-        "code": auth_code,
-        "redirect_uri": "http://45.8.229.240:8000/oauth/callback/"
-    }
-
-    # Запрос токенов
-    response = requests.post(url, json=data)
-
-    # Проверка и обработка ответа
-    if response.status_code == 200:
-        tokens = response.json()
-        # Сохраните токены для дальнейшего использования
-        # Например, в сессии или базе данных
-        return JsonResponse(tokens)
-    else:
-        return JsonResponse({"error": "Failed to get tokens", "details": response.json()}, status=response.status_code)
+    # Обмен кода на токены через общий клиент (пул соединений, таймауты)
+    try:
+        tokens = get_amocrm_client().exchange_code(auth_code)
+    except requests.HTTPError as e:
+        details = e.response.json() if e.response.content else {}
+        return JsonResponse({"error": "Failed to get tokens", "details": details}, status=e.response.status_code)
+    except requests.RequestException as e:
+        logger.error(f"AmoCRM token exchange failed: {e}")
+        return JsonResponse({"error": "Failed to get tokens"}, status=502)
+
+    # Сохраните токены для дальнейшего использования
+    # Например, в сессии или базе данных
+    return JsonResponse(tokens)
 
 
 class RegisterView(generics.CreateAPIView):
@@ -253,76 +264,58 @@ class GymDetailView(generics.RetrieveUpdateDestroyAPIView):
 
 
 class TrainingListView(generics.ListCreateAPIView):
-    queryset = Training.objects.all()
+    queryset = Training.objects.select_related('gym', 'trainer__user')
     serializer_class = TrainingSerializer
+    pagination_class = TrainingCursorPagination
+    filter_backends = (DjangoFilterBackend,)
+    filterset_class = TrainingFilter
+
+    def get_serializer_class(self):
+        # Список отдаём в компактном виде, полный состав — только в TrainingDetailView
+        if self.request.method == 'GET':
+            return TrainingListSerializer
+        return TrainingSerializer
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        user = self.request.user
+        if self.request.method == 'GET' and user.is_authenticated:
+            queryset = queryset.annotate(is_enrolled=Exists(
+                Reservation.objects.filter(
+                    training_id=OuterRef('pk'), user_id=user.pk)))
+        return queryset
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         training = serializer.save()
 
-        if training.is_recurring and training.recurrence_end_date:
-            self.create_recurring_trainings(training)
+        created = [training]
+        if training.is_recurring and not training.lazy_occurrences:
+            created += materialize_series(training)
+        auto_enroll_trainings(created)
 
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
-    def create_recurring_trainings(self, training):
-        current_date = training.date
-        end_date = training.recurrence_end_date
-
-        while current_date.date() + timezone.timedelta(days=7) <= end_date:
-            current_date += timezone.timedelta(days=7)
-            Training.objects.create(
-                gym=training.gym,
-                trainer=training.trainer,
-                date=current_date,
-                level=training.level,
-                max_participants=training.max_participants,
-                intensity=training.intensity,
-                is_recurring=True,
-                recurrence_end_date=training.recurrence_end_date,
-                parent_training=training
-            )
-
 
 class ManageRecurringTrainingsView(APIView):
-    permission_classes = [permissions.IsAuthenticated(
-    ), permissions.OR(IsAdminUser(), IsTrainerUser())]
+    def get_permissions(self):
+        return [permissions.IsAuthenticated(), permissions.OR(IsAdminUser(), IsTrainerUser())]
 
     def post(self, request):
-        today = timezone.now().date()
-        trainings = Training.objects.filter(
-            is_recurring=True,
-            recurrence_end_date__gte=today,
-            date__date=today
-        )
-
-        created_trainings = []
-        for training in trainings:
-            next_week = today + timezone.timedelta(days=7)
-            if not Training.objects.filter(parent_training=training, date__date=next_week).exists():
-                new_training = Training.objects.create(
-                    gym=training.gym,
-                    trainer=training.trainer,
-                    date=training.date + timezone.timedelta(days=7),
-                    level=training.level,
-                    max_participants=training.max_participants,
-                    intensity=training.intensity,
-                    is_recurring=True,
-                    recurrence_end_date=training.recurrence_end_date,
-                    parent_training=training
-                )
-                created_trainings.append(str(new_training))
-
+        # То же, что команда generate_schedule: повторения на весь горизонт
+        created_trainings = generate_schedule(
+            timezone.localdate() + timezone.timedelta(weeks=settings.SCHEDULE_HORIZON_WEEKS))
         return Response({
             "message": f"Created {len(created_trainings)} new recurring trainings.",
-            "created_trainings": created_trainings
+            "created_trainings": [str(training) for training in created_trainings]
         }, status=status.HTTP_200_OK)
 
 
 class TrainingDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Training.objects.all()
+    queryset = Training.objects.select_related('gym', 'trainer__user').prefetch_related(
+        Prefetch('participants', queryset=CustomUser.objects.only(*PARTICIPANT_FIELDS)))
     serializer_class = TrainingSerializer
 
     def get_permissions(self):
@@ -335,6 +328,73 @@ class TrainingDetailView(generics.RetrieveUpdateDestroyAPIView):
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
+    def perform_update(self, serializer):
+        # Повторение серии, изменённое отдельно, правки всей серии больше не трогают
+        extra = {'is_exception': True} if serializer.instance.parent_training_id else {}
+        old_date = serializer.instance.date
+        # Увеличение max_participants освобождает места для резерва
+        with transaction.atomic():
+            training = serializer.save(**extra)
+            if training.date != old_date:
+                schedule_confirmations([training.pk], reset=True)
+                notify(Reservation.objects.filter(training=training).values_list('user_id', flat=True),
+                       'schedule_changed', training=training, date=training.date)
+            promote_waitlist([training.pk])
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        # Уведомления переживают тренировку: дата остаётся в payload
+        notify(Reservation.objects.filter(training=instance).values_list('user_id', flat=True),
+               'training_cancelled', training_id=instance.pk, date=instance.date)
+        # Удалённое повторение серии не должно вернуться при генерации расписания
+        if instance.parent_training_id and instance.occurrence_date:
+            exclude_day(instance.parent_training_id, instance.occurrence_date)
+        instance.delete()
+
+
+class TrainingSeriesView(APIView):
+    """
+    Правка серии, в которую входит тренировка pk: всей серии или этого
+    повторения и следующих (для ленивой серии день можно передать в
+    occurrence_date). Записанным участникам уходит одно пакетное письмо.
+    """
+
+    def get_permissions(self):
+        return [permissions.IsAuthenticated(), permissions.OR(IsAdminUser(), IsTrainerUser())]
+
+    def patch(self, request, pk):
+        training = Training.objects.select_related('parent_training').filter(pk=pk).first()
+        if training is None or not training.is_recurring:
+            return Response({'error': 'Серия тренировок не найдена'}, status=status.HTTP_404_NOT_FOUND)
+
+        serializer = SeriesUpdateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        series = training.parent_training or training
+        day = training.occurrence_date or timezone.localtime(training.date).date()
+        if 'occurrence_date' in request.data and training.pk == series.pk:
+            try:
+                day = datetime.date.fromisoformat(request.data['occurrence_date'])
+            except (TypeError, ValueError):
+                return Response({'error': 'Некорректная дата повторения'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            with transaction.atomic():
+                training_ids = update_series(
+                    series, serializer.get_changes(), scope=serializer.validated_data['scope'],
+                    day=day, time=serializer.validated_data.get('time'))
+                user_ids = list(Reservation.objects.filter(
+                    training_id__in=training_ids).values_list('user_id', flat=True).distinct())
+                publish_many('series.updated', [
+                    {'training_id': series.pk, 'user_id': user_id} for user_id in user_ids])
+                notify(user_ids, 'schedule_changed', training=series)
+        except SeriesCapacityError as e:
+            return Response({'error': 'На тренировки записано больше участников, чем новый лимит',
+                             'training_ids': e.training_ids}, status=status.HTTP_400_BAD_REQUEST)
+        except ValueError:
+            return Response({'error': 'В этот день тренировки серии нет'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({'updated': len(training_ids), 'training_ids': training_ids})
+
 
 class SubscriptionListView(generics.ListCreateAPIView):
     serializer_class = SubscriptionSerializer
@@ -366,6 +426,7 @@ class SubscriptionDetailView(generics.RetrieveUpdateDestroyAPIView):
 class CreateSubscriptionView(APIView):
     permission_classes = (permissions.IsAuthenticated,)
 
+    @idempotent
     @transaction.atomic
     def post(self, request):
         # Если пользователь не передан в запросе, используем пользователя из токена аутентификации
@@ -402,9 +463,6 @@ class CreateSubscriptionView(APIView):
                 subscription.payment_id = payment.id
                 subscription.save()
 
-                # Автоматическая запись на тренировки
-                subscription.enroll_user_to_trainings()
-
                 return Response({'payment_url': payment.confirmation.confirmation_url}, status=status.HTTP_201_CREATED)
 
             except Exception as e:
@@ -429,7 +487,7 @@ class TrainerListView(generics.ListAPIView):
     permission_classes = [permissions.AllowAny]
 
     def get_queryset(self):
-        return Trainer.objects.filter(user__role='trainer')
+        return Trainer.objects.filter(user__role='trainer').select_related('user')
 
 
 class TrainerDetailView(generics.RetrieveUpdateDestroyAPIView):
@@ -467,104 +525,276 @@ class TrainerDetailView(generics.RetrieveUpdateDestroyAPIView):
 class TrainingEnrollView(APIView):
     permission_classes = (permissions.IsAuthenticated,)
 
+    @idempotent
     def post(self, request, pk):
         try:
             training = Training.objects.get(pk=pk)
         except Training.DoesNotExist:
             return Response({'error': 'Тренировка не найдена'}, status=status.HTTP_404_NOT_FOUND)
 
-        if request.user in training.participants.all():
-            return Response({'error': 'Вы уже записались на эту тренировку'}, status=status.HTTP_400_BAD_REQUEST)
-
-        if training.current_participants >= training.max_participants:
-            training.add_to_reserve(request.user)
-            return Response({'success': 'Вы добавлены в резерв'}, status=status.HTTP_200_OK)
-
-        subscription = Subscription.objects.filter(
-            user=request.user, is_paid=True).first()
-        if not subscription:
-            return Response({'error': 'У вас нет абонемента'}, status=status.HTTP_403_FORBIDDEN)
-
-        if not subscription.is_valid_for_training(training):
-            return Response({'error': 'Ваш абонемент не действителен для этой тренировки'}, status=status.HTTP_403_FORBIDDEN)
-
-        training.participants.add(request.user)
-        training.current_participants = training.participants.count()
-        training.save()
+        if training.queued_enrollment:
+            # Популярная тренировка: заявку разберёт обработчик очереди
+            ticket, _ = EnrollmentTicket.objects.get_or_create(
+                training=training, user=request.user, status='pending')
+            return Response(EnrollmentTicketSerializer(ticket).data, status=status.HTTP_202_ACCEPTED)
 
-        subscription.use_training()
+        # Место занимается условным UPDATE, а строка участника вставляется в той же
+        # короткой транзакции: при любом отказе откатываются обе операции
+        try:
+            with transaction.atomic():
+                if is_enrolled(training.pk, request.user.pk):
+                    return Response({'error': 'Вы уже записались на эту тренировку'}, status=status.HTTP_400_BAD_REQUEST)
+
+                if not take_seat(training.pk):
+                    if not training.add_to_reserve(request.user):
+                        return Response({'error': 'Вы уже в резерве на эту тренировку'}, status=status.HTTP_400_BAD_REQUEST)
+                    return Response({'success': 'Вы добавлены в резерв'}, status=status.HTTP_200_OK)
+
+                subscription = Subscription.objects.filter(
+                    user=request.user, is_paid=True).first()
+                if not subscription:
+                    transaction.set_rollback(True)
+                    return Response({'error': 'У вас нет абонемента'}, status=status.HTTP_403_FORBIDDEN)
+
+                if not subscription.is_valid_for_training(training):
+                    transaction.set_rollback(True)
+                    return Response({'error': 'Ваш абонемент не действителен для этой тренировки'}, status=status.HTTP_403_FORBIDDEN)
+
+                if not subscription.use_training():
+                    # Место, занятое take_seat, освобождается откатом
+                    transaction.set_rollback(True)
+                    return Response({'error': 'В абонементе не осталось тренировок'}, status=status.HTTP_403_FORBIDDEN)
+
+                Reservation.objects.create(
+                    training=training, user=request.user, subscription=subscription,
+                    **Reservation.deadlines(training.date))
+                WaitlistEntry.objects.filter(
+                    training_id=training.pk, user_id=request.user.pk).delete()
+        except IntegrityError:
+            # Параллельный запрос того же пользователя успел вставить строку первым
+            return Response({'error': 'Вы уже записались на эту тренировку'}, status=status.HTTP_400_BAD_REQUEST)
 
         return Response({'success': 'Вы записались на тренировку'}, status=status.HTTP_200_OK)
 
 
-class TrainingConfirmView(APIView):
+class TrainingUnenrollView(APIView):
     permission_classes = (permissions.IsAuthenticated,)
 
+    @idempotent
     def post(self, request, pk):
         try:
             training = Training.objects.get(pk=pk)
         except Training.DoesNotExist:
             return Response({'error': 'Тренировка не найдена'}, status=status.HTTP_404_NOT_FOUND)
 
-        subscription = Subscription.objects.filter(
-            user=request.user, is_paid=True).first()
-        if not subscription:
-            return Response({'error': 'У вас нет абонемента'}, status=status.HTTP_403_FORBIDDEN)
+        reservation = Reservation.objects.filter(
+            training=training, user=request.user).only('status').first()
+        if reservation is None:
+            return Response({'error': 'Вы не записаны на эту тренировку'}, status=status.HTTP_400_BAD_REQUEST)
 
-        if subscription.confirmed:
-            return Response({'error': 'Вы уже подтвердили запись'}, status=status.HTTP_400_BAD_REQUEST)
+        if reservation.status == 'confirmed':
+            return Response({'error': 'Вы уже подтвердили запись и не можете отменить её'}, status=status.HTTP_400_BAD_REQUEST)
 
-        subscription.confirm_enrollment()
+        # Освободившееся место сразу получает следующий в резерве
+        with transaction.atomic():
+            training.participants.remove(request.user)
+            promote_waitlist([training.pk], exclude_user_ids={request.user.pk})
 
-        return Response({'success': 'Вы подтвердили запись на тренировку'}, status=status.HTTP_200_OK)
+        return Response({'success': 'Вы отменили запись на тренировку'}, status=status.HTTP_200_OK)
 
 
-class TrainingUnenrollView(APIView):
-    permission_classes = (permissions.IsAuthenticated,)
+class TrainingRosterView(APIView):
+    def get_permissions(self):
+        return [permissions.IsAuthenticated(), permissions.OR(IsAdminUser(), IsTrainerUser())]
+
+    def get(self, request, pk):
+        if not Training.objects.filter(pk=pk).exists():
+            return Response({'error': 'Тренировка не найдена'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(self.roster(pk))
 
     def post(self, request, pk):
-        try:
-            training = Training.objects.get(pk=pk)
-        except Training.DoesNotExist:
+        if not Training.objects.filter(pk=pk).exists():
             return Response({'error': 'Тренировка не найдена'}, status=status.HTTP_404_NOT_FOUND)
 
-        if request.user not in training.participants.all():
-            return Response({'error': 'Вы не записаны на эту тренировку'}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = RosterUpdateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        operations = [(operation['op'], operation['user_id'])
+                      for operation in serializer.validated_data['operations']]
+        try:
+            apply_roster_operations(pk, operations)
+        except ValueError:
+            return Response({'error': 'Недостаточно мест на тренировке'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.roster(pk))
+
+    def roster(self, pk):
+        participants = CustomUser.objects.filter(
+            trainings=pk).order_by('last_name', 'first_name')
+        reserve = CustomUser.objects.filter(waitlistentry__training=pk).order_by(
+            '-waitlistentry__is_priority', '-waitlistentry__priority', 'waitlistentry__id')
+        return {
+            'participants': RosterMemberSerializer(participants, many=True).data,
+            'reserve': RosterMemberSerializer(reserve, many=True).data,
+        }
+
+
+class EnrollmentTicketDetailView(generics.RetrieveAPIView):
+    serializer_class = EnrollmentTicketSerializer
+    permission_classes = (permissions.IsAuthenticated,)
 
-        subscription = Subscription.objects.filter(
-            user=request.user, is_paid=True).first()
-        if not subscription:
-            return Response({'error': 'У вас нет абонемента'}, status=status.HTTP_403_FORBIDDEN)
+    def get_queryset(self):
+        return EnrollmentTicket.objects.filter(user=self.request.user)
 
-        if subscription.confirmed:
-            return Response({'error': 'Вы уже подтвердили запись и не можете отменить её'}, status=status.HTTP_400_BAD_REQUEST)
 
-        training.participants.remove(request.user)
-        training.current_participants = training.participants.count()
-        training.save()
+class NotificationListView(generics.ListAPIView):
+    """
+    Почтовый ящик пользователя с курсорной пагинацией; ?unread=true
+    оставляет только непрочитанные.
+    """
+    serializer_class = NotificationSerializer
+    permission_classes = (permissions.IsAuthenticated,)
+    pagination_class = NotificationCursorPagination
 
-        return Response({'success': 'Вы отменили запись на тренировку'}, status=status.HTTP_200_OK)
+    def get_queryset(self):
+        queryset = Notification.objects.filter(user=self.request.user)
+        if self.request.query_params.get('unread') in ('1', 'true'):
+            queryset = queryset.filter(is_read=False)
+        return queryset
+
+
+class NotificationUnreadCountView(APIView):
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def get(self, request):
+        return Response({'unread': unread_count(request.user)})
+
+
+class NotificationReadView(APIView):
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def post(self, request):
+        serializer = NotificationReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        marked = mark_read(request.user, serializer.validated_data.get('ids'))
+        return Response({'marked': marked, 'unread': unread_count(request.user)})
+
+
+class TrainingScheduleView(APIView):
+    """
+    Расписание за окно дат: сохранённые тренировки и виртуальные повторения
+    ленивых серий. Окно (date_from, date_to) обязательно и не длиннее
+    SCHEDULE_MAX_DAYS; остальные фильтры — как у списка тренировок.
+    """
+    permission_classes = (permissions.AllowAny,)
+
+    def get(self, request):
+        try:
+            date_from = datetime.date.fromisoformat(request.query_params['date_from'])
+            date_to = datetime.date.fromisoformat(request.query_params['date_to'])
+        except (KeyError, ValueError):
+            return Response({'error': 'Укажите date_from и date_to в формате ГГГГ-ММ-ДД'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if date_to < date_from or (date_to - date_from).days >= settings.SCHEDULE_MAX_DAYS:
+            return Response({'error': f'Окно расписания — не больше {settings.SCHEDULE_MAX_DAYS} дней'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        params = request.query_params.copy()
+        params.pop('date_from')
+        params.pop('date_to')
+        filterset = TrainingFilter(params, queryset=Training.objects.none())
+        if not filterset.is_valid():
+            return Response(filterset.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        window_start, window_end = start_of_day(date_from), start_of_day(date_to + datetime.timedelta(days=1))
+        base = filterset.filter_queryset(
+            Training.objects.select_related('gym', 'trainer__user'))
+
+        trainings = base.filter(date__gte=window_start, date__lt=window_end)
+        if request.user.is_authenticated:
+            trainings = trainings.annotate(is_enrolled=Exists(
+                Reservation.objects.filter(training_id=OuterRef('pk'), user_id=request.user.pk)))
+        trainings = list(trainings)
+
+        series = list(base.filter(
+            Q(recurrence_end_date__isnull=True) | Q(
+                recurrence_end_date__gte=date_from),
+            is_recurring=True,
+            lazy_occurrences=True,
+            parent_training__isnull=True,
+            date__lt=window_end,
+        ))
+        # Повторения, сохранённые в окне по дню серии (время могли перенести)
+        materialized = Training.objects.filter(
+            parent_training__in=series, occurrence_date__range=(date_from, date_to)
+        ).values_list('parent_training_id', 'occurrence_date') if series else []
+
+        items = trainings + \
+            virtual_occurrences(series, date_from, date_to, materialized)
+        items.sort(key=lambda training: (training.date, training.pk or 0))
+        return Response(ScheduleItemSerializer(items, many=True).data)
+
+
+class TrainingOccurrenceView(APIView):
+    """
+    Повторение ленивой серии на конкретный день: POST сохраняет его (после
+    этого на тренировку можно записаться по id), DELETE исключает день из серии.
+    """
+
+    def get_permissions(self):
+        if self.request.method == 'DELETE':
+            return [permissions.IsAuthenticated(), permissions.OR(IsAdminUser(), IsTrainerUser())]
+        return [permissions.IsAuthenticated()]
+
+    def get_series_and_day(self, pk, day):
+        try:
+            day = datetime.date.fromisoformat(day)
+        except ValueError:
+            return None, None
+        series = Training.objects.filter(
+            pk=pk, is_recurring=True, parent_training__isnull=True).first()
+        return series, day
+
+    def post(self, request, pk, day):
+        series, day = self.get_series_and_day(pk, day)
+        if series is None:
+            return Response({'error': 'Серия тренировок не найдена'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            training, created = materialize_occurrence(series, day)
+        except ValueError:
+            return Response({'error': 'В этот день тренировки серии нет'}, status=status.HTTP_400_BAD_REQUEST)
+        if created:
+            auto_enroll_trainings([training])
+        return Response(TrainingSerializer(training).data,
+                        status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+    def delete(self, request, pk, day):
+        series, day = self.get_series_and_day(pk, day)
+        if series is None:
+            return Response({'error': 'Серия тренировок не найдена'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            cancel_occurrence(series, day)
+        except ValueError:
+            return Response({'error': 'В этот день тренировки серии нет'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
 
 class TrainingConfirmView(APIView):
     permission_classes = (permissions.IsAuthenticated,)
 
+    @idempotent
     def post(self, request, pk):
         try:
             training = Training.objects.get(pk=pk)
         except Training.DoesNotExist:
             return Response({'error': 'Тренировка не найдена'}, status=status.HTTP_404_NOT_FOUND)
 
-        subscription = Subscription.objects.filter(
-            user=request.user, is_paid=True).first()
-        if not subscription:
-            return Response({'error': 'У вас нет абонемента'}, status=status.HTTP_403_FORBIDDEN)
+        reservation = Reservation.objects.filter(
+            training=training, user=request.user).only('status').first()
+        if reservation is None:
+            return Response({'error': 'Вы не записаны на эту тренировку'}, status=status.HTTP_400_BAD_REQUEST)
 
-        if subscription.confirmed:
+        if not reservation.confirm():
             return Response({'error': 'Вы уже подтвердили запись'}, status=status.HTTP_400_BAD_REQUEST)
 
-        subscription.confirm_enrollment()
-
         return Response({'success': 'Вы подтвердили запись на тренировку'}, status=status.HTTP_200_OK)
 
 